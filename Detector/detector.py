@@ -1,6 +1,7 @@
 import sys
 import getopt
-import requests
+from iotclient import IoTClient
+from iotjson import decode, accept_header, nrows, column, take, concat
 import json
 import time
 import threading
@@ -8,7 +9,12 @@ import os
 import operator
 import datetime
 import importlib 
+import numpy as np
 from plotter import *
+from ingest import IngestEngine, Prefetcher, POLICIES
+from workers import ProcessorProxy
+from processor import SharedAugmenter
+from rangecache import RangeCache, CachedRecording
 sys.path.insert(0, os.getcwd()) # import from current directory
 
 # Defaults:
@@ -22,9 +28,21 @@ processors = []
 processor_threads = []
 savemovie = False
 moviefile = 'out.mp4'
+retention = None
+retention_rows = None
+http_timeout = 10
+http_retries = 3
+client = None
+queue_depth = 4
+queue_policy = 'block'
+workers = 'thread'
+prefetch = 4 # windows
+speed = 1.0
+cachedir = 'NONE'
+engine = None
 
 ############################################## OPTIONS
-def usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, do_debug):
+def usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, queue_policy, workers, prefetch, speed, cachedir, do_debug):
 	print('%s [<options>] [<processor1> <processor2> ...]' % sys.argv[0])
 	print('where <options> are:\n' \
 			'\t-h - show this help message\n' \
@@ -34,8 +52,18 @@ def usage(server, db_password, certfile, timescale, simulate_real_time, savemovi
             '\t-t <timescale> - scale of interrogator time (i.e., 1 for 1 unit per second): default %s\n' \
             '\t-i - simulate real-time by going through the whole database contents from the beginning, instead of pulling from the end: default %s\n' \
             '\t-s <moviefilename> - save the movie plot with the given pathname: default %s with a path of %s\n' \
+            '\t-r <seconds> - number of seconds of data each processor keeps (older data is evicted as new data arrives), or 0 to keep everything: default %s\n' \
+            '\t-n <rows> - number of rows of data each processor keeps, or 0 to keep everything: default %s\n' \
+            '\t-w <seconds> - seconds to wait for the server to respond to a request: default %s\n' \
+            '\t-y <retries> - number of times to retry a failed request to the server: default %s\n' \
+            '\t-b <batches> - number of batches that may wait for each processor: default %s\n' \
+            '\t-q <policy> - what to do with a new batch when a processor has too many waiting (%s): default %s\n' \
+            '\t--workers <thread|process> - run each processor as a thread of the detector, or in its own worker process: default %s\n' \
+            '\t--prefetch <windows> - number of one-second windows of data to fetch ahead of time when simulating real-time (-i): default %s\n' \
+            '\t--speed <multiplier> - how many times faster than real time to replay the data when simulating real-time (-i): default %s\n' \
+            '\t-e <directory> - directory in which to cache the recording when simulating real-time (-i), i.e., ~/.cache/iot-processing-framework, or NONE to always download it: default %s\n' \
             '\tprocessors include any module and class included in the current directory, i.e., processor_respiratoryrate.RespiratoryRateProcessor\n' \
-			'\t-d - Enable debugging: default %s\n' % (server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, do_debug))
+			'\t-d - Enable debugging: default %s\n' % (server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, ', '.join(POLICIES), queue_policy, workers, prefetch, speed, cachedir, do_debug))
 	sys.exit(1)
 
 def getopts():
@@ -48,19 +76,29 @@ def getopts():
     global processors
     global savemovie
     global moviefile
+    global retention
+    global retention_rows
+    global http_timeout
+    global http_retries
+    global queue_depth
+    global queue_policy
+    global workers
+    global prefetch
+    global speed
+    global cachedir
 
 	# Check command line
-    optlist, argslist = getopt.getopt(sys.argv[1:], 'ho:p:c:t:dim:s:')
+    optlist, argslist = getopt.getopt(sys.argv[1:], 'ho:p:c:t:dim:s:r:n:w:y:b:q:e:', ['workers=', 'prefetch=', 'speed='])
     
     # if no processors specified, quit
     if len(argslist) == 0:
         print('Must specify at least one processor.')
-        usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, do_debug)
+        usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, queue_policy, workers, prefetch, speed, cachedir, do_debug)
         sys.exit(1)
     
     for opt in optlist:
         if opt[0] == '-h':
-            usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, do_debug)
+            usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, queue_policy, workers, prefetch, speed, cachedir, do_debug)
         if opt[0] == '-p':
             db_password = opt[1]
         if opt[0] == '-o':
@@ -76,6 +114,39 @@ def getopts():
         if opt[0] == '-s':
             savemovie = True
             moviefile = opt[1]
+        if opt[0] == '-r':
+            retention = float(opt[1])
+            if retention <= 0:
+                retention = None
+        if opt[0] == '-n':
+            retention_rows = int(opt[1])
+            if retention_rows <= 0:
+                retention_rows = None
+        if opt[0] == '-w':
+            http_timeout = float(opt[1])
+        if opt[0] == '-y':
+            http_retries = int(opt[1])
+        if opt[0] == '-b':
+            queue_depth = int(opt[1])
+        if opt[0] == '-q':
+            queue_policy = opt[1]
+            if not (queue_policy in POLICIES):
+                print('Unknown queue policy ' + queue_policy)
+                usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, queue_policy, workers, prefetch, speed, cachedir, do_debug)
+        if opt[0] == '-e':
+            cachedir = opt[1]
+        if opt[0] == '--prefetch':
+            prefetch = int(opt[1])
+        if opt[0] == '--speed':
+            speed = float(opt[1])
+            if speed <= 0:
+                print('The speed must be greater than 0')
+                usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, queue_policy, workers, prefetch, speed, cachedir, do_debug)
+        if opt[0] == '--workers':
+            workers = opt[1]
+            if not (workers in ('thread', 'process')):
+                print('Unknown worker type ' + workers)
+                usage(server, db_password, certfile, timescale, simulate_real_time, savemovie, moviefile, retention, retention_rows, http_timeout, http_retries, queue_depth, queue_policy, workers, prefetch, speed, cachedir, do_debug)
             
     processors.extend(argslist)
 
@@ -90,28 +161,38 @@ def log(msg):
 
 def sendhttp(url, headerdict=dict(), bodydict=dict(), method='POST'):
     global certfile
+    global http_timeout
+    global http_retries
+    global client
 
-    if certfile == 'NONE':
-        verifypath = False
-    else:
-        verifypath = certfile
+    # all requests share one client, which keeps its connections to the server open between polls
+    if client is None:
+        client = IoTClient(certfile=certfile, timeout=http_timeout, retries=http_retries)
+
+    return client.sendhttp(url, headerdict, bodydict, method)
 
-    if method.lower() == 'get':
-        fun = requests.get
-    elif method.lower() == 'put':
-        fun = requests.put
-    elif method.lower() == 'post':
-        fun = requests.post
+def retrieve_last_n_data(n=1):
+    global db_password
+    global server
 
-    response = fun(url, verify = verifypath, data = json.dumps(bodydict), headers=headerdict)
+    resp, content = sendhttp(server + '/api/iot/stats/seconds/' + str(n), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
-    return response, response.text
+    return resp, content
 
-def retrieve_last_n_data(n=1):
+def retrieve_since(timestamp):
+    global db_password
+    global server
+
+    resp, content = sendhttp(server + '/api/iot/' + str(timestamp), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
+
+    return resp, content
+
+# like retrieve_data, but given in units of relative_timestamp rather than seconds
+def retrieve_range(starttime, endtime):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/stats/seconds/' + str(n), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/' + str(int(starttime)) + '/' + str(int(endtime)), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
 
@@ -120,7 +201,7 @@ def retrieve_data(start, end):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/' + str(start * timescale) + '/' + str(end * timescale), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/' + str(start * timescale) + '/' + str(end * timescale), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
 
@@ -130,6 +211,37 @@ def get_max_reltime():
     resp, content = sendhttp(server + '/api/iot/maxtime', method='GET')
 
     return resp, content
+
+# the most recent relative_timestamp on the server, or (if the server cannot be reached) the most recent one cached
+def get_max_db_time(cache):
+    global server
+    global timescale
+
+    try:
+        resp, content = get_max_reltime()
+        max_db_time = int(decode(resp, content)['data'][0]['max_relative_timestamp'])
+    except Exception as e:
+        if cache is None or cache.get_maxtime(server, timescale) is None:
+            raise
+        log('Could not reach the server (' + str(e) + '); replaying the cached recording')
+        return cache.get_maxtime(server, timescale)
+
+    if not (cache is None):
+        cache.put_maxtime(server, timescale, max_db_time)
+
+    return max_db_time
+
+# the whole recording up to max_db_time, read a minute at a time as the replay reaches it: from the cache if that
+# minute has been replayed before, or else downloaded and cached
+def open_recording(cache, max_db_time):
+    global server
+    global timescale
+
+    def fetch(starttime, endtime):
+        resp, content = retrieve_range(starttime, endtime)
+        return decode(resp, content)['data']
+
+    return CachedRecording(cache, server, 0, max_db_time + 1, timescale, fetch, chunk=60 * timescale)
     
 # Function to watch CTRL+C keyboard input
 def prog_quit(QUITFILE='quit'):
@@ -143,69 +255,174 @@ def prog_quit(QUITFILE='quit'):
         except:
             os._exit(0)
     
-def add_data_to_processor_thread(pt, body):
-    pt.add_data(body)
+# Tracks the newest relative_timestamp passed to the processors (the high-water mark), so that each poll only
+# fetches, and only hands on, rows that have not been seen before
+class ReadCursor(object):
+    def __init__(self):
+        self.hwm = None
+        self.seenathwm = set() # rows whose timestamp equals the high-water mark, in case the server includes them again
+        self.lastpoll = None # time of the last successful poll
+        self.lasterror = None # time that a failed poll was last reported
+        self.errors = 0 # number of failed polls since then
+
+    # the rows that are newer than those already seen, advancing the high-water mark past them; rows may be a list of
+    # row dicts or a dict of columns
+    def advance(self, rows):
+        timestamps = np.asarray(column(rows, 'relative_timestamp'), dtype='int64')
+        keycolumns = [column(rows, col) for col in ('epc96', 'antenna', 'freeform')]
+
+        def rowkey(i):
+            return tuple(keycol[i] for keycol in keycolumns)
+
+        if self.hwm is None:
+            new = np.ones(len(timestamps), dtype=bool)
+        else:
+            new = timestamps > self.hwm
+            for i in np.flatnonzero(timestamps == self.hwm):
+                new[i] = not (rowkey(i) in self.seenathwm)
+
+        if not new.any():
+            return take(rows, new)
+
+        newest = int(timestamps[new].max())
+        if self.hwm is None or newest > self.hwm:
+            self.hwm = newest
+            self.seenathwm = set()
+
+        for i in np.flatnonzero(new & (timestamps == self.hwm)):
+            self.seenathwm.add(rowkey(i))
+
+        return take(rows, new)
+
+# report a failed poll on stderr, at most once every quiet seconds so that an outage does not flood it
+def poll_failed(cursor, e, now, quiet=60):
+    cursor.errors = cursor.errors + 1
+
+    if cursor.lasterror is None or (now - cursor.lasterror).total_seconds() >= quiet:
+        sys.stderr.write('Poll failed (' + str(cursor.errors) + ' since last reported): ' + str(e) + '\n')
+        cursor.lasterror = now
+        cursor.errors = 0
+
+# fetch the rows added since the last poll; if the last successful poll was more than late * seconds ago (or there
+# was none), the missed span is first backfilled one window of the given number of seconds at a time
+def poll_cursor(cursor, seconds, late=2):
+    global timescale
+
+    now = datetime.datetime.now()
+    rows = [] # the new rows from each request
+
+    try:
+        if cursor.hwm is None:
+            resp, content = retrieve_last_n_data(n=seconds)
+            rows.append(cursor.advance(decode(resp, content)['data']))
+        else:
+            elapsed = (now - cursor.lastpoll).total_seconds()
+
+            if elapsed > late * seconds:
+                log('Poll is ' + str(elapsed) + ' seconds since the last; backfilling from ' + str(cursor.hwm))
+
+                # windows keep each response small; a window with nothing recorded in it just moves on to the next
+                starttime = cursor.hwm
+                endtime = cursor.hwm + elapsed * timescale
+                while starttime < endtime:
+                    resp, content = retrieve_range(starttime, starttime + seconds * timescale)
+                    rows.append(cursor.advance(decode(resp, content)['data']))
+                    starttime = max(cursor.hwm, starttime + seconds * timescale)
+
+            resp, content = retrieve_since(cursor.hwm)
+            rows.append(cursor.advance(decode(resp, content)['data']))
+    except Exception as e:
+        # the cursor has only advanced past the rows returned here, and the next poll will backfill from there
+        poll_failed(cursor, e, now)
+        return {'data': concat(rows)}
+
+    cursor.lastpoll = now
+
+    return {'data': concat(rows)}
    
 def readdata(pt_sem):
     global timescale
     global processors
     global processor_threads
+    global retention
+    global retention_rows
+    global queue_depth
+    global queue_policy
+    global engine
+    global workers
+    global prefetch
+    global speed
+    global cachedir
     
+    # processors that only add the augmented data read it from one store, augmented once per batch; the others (and
+    # processors in worker processes) are given each batch to add themselves
+    augmenter = SharedAugmenter(retention=retention, retention_rows=retention_rows)
+    consumers = []
+
     for processor in processors:
         # for each processor, determine what it is, and start the appropriate subobject thread, passing it data as it comes, add to the threads list, and start
-        ptclass = getattr(importlib.import_module(processor.split(".")[0]), processor.split(".")[1])
-        ptinstance = ptclass() # instantiate the Processor subobject
+        if workers == 'process':
+            ptinstance = ProcessorProxy(processor) # the Processor subobject is instantiated in its worker process when started
+        else:
+            ptclass = getattr(importlib.import_module(processor.split(".")[0]), processor.split(".")[1])
+            ptinstance = ptclass() # instantiate the Processor subobject
+        ptinstance.set_retention(retention, retention_rows)
+        if workers != 'process' and ptinstance.shareable():
+            augmenter.subscribe(ptinstance)
+        else:
+            consumers.append(ptinstance)
         processor_threads.append(ptinstance)
         ptinstance.start_thread()
     pt_sem.release()
 
-    # if simulating real time, figure out how long the database goes
+    if len(augmenter.subscribers) > 0:
+        consumers.insert(0, augmenter)
+
+    # if simulating real time, figure out how long the database goes, and open the recording if it is to be cached
+    recording = None
     if simulate_real_time == True:
-        resp, content = get_max_reltime()
-        body = json.loads(content)
-        #print body
-        max_db_time = int(body['data'][0]['max_relative_timestamp'])
+        cache = None
+        if cachedir != 'NONE':
+            cache = RangeCache(cachedir)
+
+        max_db_time = get_max_db_time(cache)
+
+        if not (cache is None):
+            recording = open_recording(cache, max_db_time)
     else:
         max_db_time = -1
 
-    iterations = 0
-
-    prevread = None
     seconds = 1
-    while 1:
-        # get data
+    cursor = ReadCursor()
+    interval = seconds
+
+    # a simulation replays the database a window of seconds at a time from the beginning, with the windows fetched ahead
+    prefetcher = None
+    if simulate_real_time == True:
+        def fetchwindow(start):
+            if recording is None:
+                resp, content = retrieve_data(start, start+seconds)
+                return decode(resp, content)
+            else:
+                return {'data': recording.window(start * timescale, (start+seconds) * timescale)}
+
+        prefetcher = Prefetcher(fetchwindow, range(0, max_db_time // timescale + 1, seconds), depth=prefetch)
+        interval = seconds * 1.0 / speed
+
+    # each call fetches the next second of data, or returns None once a simulation reaches the end of the database
+    def fetch():
         if simulate_real_time == True:
-            resp, content = retrieve_data(iterations, iterations+seconds)
+            return prefetcher.next()
         else:
-            resp, content = retrieve_last_n_data(n=seconds)
+            return poll_cursor(cursor, seconds)
+
+    engine = IngestEngine(consumers, fetch, interval=interval, maxqueue=queue_depth, policy=queue_policy, log=log)
+    try:
+        engine.run()
+    finally:
+        if not (prefetcher is None):
+            prefetcher.close()
 
-        if not (prevread is None):
-            #print "delay since last read:", (datetime.datetime.now() - prevread).total_seconds()
-            while (datetime.datetime.now() - prevread).total_seconds() < seconds:
-                time.sleep(0.025)
-        
-        prevread = datetime.datetime.now()
-
-        body = json.loads(content)
-        #print body
-        #for entry in body['data']:
-        #    print entry['relative_timestamp']
-        
-        add_data_threads = [] 
-        for pt in processor_threads:
-            t = threading.Thread(target=add_data_to_processor_thread, args=(pt, body, ))
-            add_data_threads.append(t)
-            t.start()
-
-        for t in add_data_threads:
-            t.join()
-
-        if simulate_real_time == True and (iterations * timescale) > max_db_time:
-            break
-
-        # advance
-        iterations = iterations + seconds
-        
     # notify the threads that we are done
     for pt in processor_threads:
         pt.notify_finished()
@@ -0,0 +1,219 @@
+import asyncio
+import collections
+import concurrent.futures
+import sys
+import time
+import traceback
+from iotjson import nrows, concat, copy_of, is_columns, to_rows
+
+# What to do with a new batch when a processor's queue is already full:
+#  drop-oldest - discard the oldest waiting batch to make room for the new one
+#  coalesce - merge the new batch into the newest waiting batch, so no reads are lost but the processor sees them together
+#  block - wait for the processor to make room, which holds up fetching (and so every other processor) until it does
+POLICIES = ('drop-oldest', 'coalesce', 'block')
+
+# A bounded queue of batches waiting for one processor, along with the metrics describing how far behind it is
+class BatchQueue(object):
+    def __init__(self, maxsize=4, policy='block'):
+        if not (policy in POLICIES):
+            raise ValueError('Unknown backpressure policy ' + str(policy) + '; expected one of ' + ', '.join(POLICIES))
+
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.batches = collections.deque() # (time fetched, body) in the order they were fetched
+        self.ready = asyncio.Condition()
+        self.closed = False
+        self.inflight = None # time the batch being processed was fetched, or None if idle
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.batches)
+
+    async def put(self, body):
+        async with self.ready:
+            if len(self.batches) >= self.maxsize:
+                if self.policy == 'drop-oldest':
+                    self.batches.popleft()
+                    self.dropped = self.dropped + 1
+                elif self.policy == 'coalesce':
+                    # the merged batch keeps the time of the older one, so that lag reflects the oldest reads waiting
+                    fetched, newest = self.batches[-1]
+                    self.batches[-1] = (fetched, {'data': concat([newest['data'], body['data']])})
+                    self.coalesced = self.coalesced + 1
+                    self.ready.notify_all()
+                    return
+                else:
+                    await self.ready.wait_for(lambda: len(self.batches) < self.maxsize)
+
+            self.batches.append((time.time(), body))
+            self.ready.notify_all()
+
+    # the next batch, or None once the queue is closed and empty
+    async def get(self):
+        async with self.ready:
+            await self.ready.wait_for(lambda: len(self.batches) > 0 or self.closed)
+
+            if len(self.batches) == 0:
+                return None
+
+            fetched, body = self.batches.popleft()
+            self.inflight = fetched
+            self.ready.notify_all()
+
+            return body
+
+    def task_done(self):
+        self.inflight = None
+        self.processed = self.processed + 1
+
+    async def close(self):
+        async with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+    # seconds since the oldest batch that the processor has not finished with was fetched
+    def lag(self):
+        oldest = self.inflight
+        if oldest is None and len(self.batches) > 0:
+            oldest = self.batches[0][0]
+
+        if oldest is None:
+            return 0
+
+        return time.time() - oldest
+
+    def metrics(self):
+        return {'depth': len(self.batches), 'lag': self.lag(), 'processed': self.processed, 'dropped': self.dropped, 'coalesced': self.coalesced}
+
+# add a batch to a processor, as a list of row dicts unless it takes columns: an add_data that a processor overrides
+# was written for rows, even if the batch arrived as columns (i.e., in the binary format or from the replay cache)
+def add(pt, body):
+    takes_columns = getattr(pt, 'takes_columns', None)
+    if is_columns(body['data']) and (takes_columns is None or not takes_columns()):
+        body = {'data': to_rows(body['data'])}
+
+    pt.add_data(body)
+
+# Runs fetching and processing on separate schedules: fetch() is called every interval seconds (it returns the next
+# body, or None when there is no more data), and each batch is placed on every processor's queue; each processor
+# then takes batches from its own queue and adds them as fast as it is able, so that a slow processor only delays itself.
+# fetch() and add_data() block, so they run on a pool of threads while the event loop schedules them.
+class IngestEngine(object):
+    def __init__(self, processors, fetch, interval=1, maxqueue=4, policy='block', log=None):
+        self.processors = processors
+        self.fetch = fetch
+        self.interval = interval
+        self.maxqueue = maxqueue
+        self.policy = policy
+        self.log = log
+        self.queues = []
+        self.executor = None
+
+    # run until fetch() returns None and every processor has consumed the batches waiting for it
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.queues = [BatchQueue(self.maxqueue, self.policy) for pt in self.processors]
+
+        # a thread for each processor and one for fetching, so that none waits on another for a thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.processors) + 1)
+
+        try:
+            consumers = [asyncio.ensure_future(self.consume(pt, queue)) for pt, queue in zip(self.processors, self.queues)]
+            await self.produce()
+            await asyncio.gather(*consumers)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    async def produce(self):
+        loop = asyncio.get_event_loop()
+        nextfetch = loop.time()
+
+        while 1:
+            body = await loop.run_in_executor(self.executor, self.fetch)
+
+            if body is None:
+                break
+
+            # each processor gets its own copy of the rows, since adding data may change them (i.e., by flattening
+            # their freeform fields or adding columns); the last is given the rows themselves, which nothing else reads
+            if nrows(body['data']) > 0:
+                for i, queue in enumerate(self.queues):
+                    if i < len(self.queues) - 1:
+                        await queue.put({'data': copy_of(body['data'])})
+                    else:
+                        await queue.put({'data': body['data']})
+
+            if not (self.log is None):
+                self.log('Ingest metrics: ' + str(self.metrics()))
+
+            # fetch at a fixed rate, regardless of how long the processors take
+            nextfetch = max(nextfetch + self.interval, loop.time())
+            await asyncio.sleep(nextfetch - loop.time())
+
+        for queue in self.queues:
+            await queue.close()
+
+    async def consume(self, pt, queue):
+        loop = asyncio.get_event_loop()
+
+        while 1:
+            body = await queue.get()
+
+            if body is None:
+                break
+
+            try:
+                await loop.run_in_executor(self.executor, add, pt, body)
+            except Exception:
+                # always reported, as otherwise a processor that fails on every batch would just stop updating
+                sys.stderr.write('Error adding data to ' + type(pt).__name__ + ':\n')
+                traceback.print_exc()
+            finally:
+                queue.task_done()
+
+    # queue depth, lag in seconds, and counts of batches processed, dropped and coalesced for each processor
+    def metrics(self):
+        return dict((type(pt).__name__ + '[' + str(i) + ']', queue.metrics()) for i, (pt, queue) in enumerate(zip(self.processors, self.queues)))
+
+# Fetches the windows of a replay ahead of time: fetch(start) is called for each of starts in turn on a pool of
+# threads, with up to depth windows in flight at once, and the bodies are handed out in order by next(), so that the
+# replay is paced by the engine's clock rather than by how long the server takes to answer each request.
+class Prefetcher(object):
+    def __init__(self, fetch, starts, depth=4):
+        self.fetch = fetch
+        self.starts = iter(starts)
+        self.depth = max(1, depth)
+        self.inflight = collections.deque() # futures of the windows fetched ahead, in order
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.depth)
+        self.fill()
+
+    def fill(self):
+        while len(self.inflight) < self.depth:
+            try:
+                start = next(self.starts)
+            except StopIteration:
+                break
+
+            self.inflight.append(self.executor.submit(self.fetch, start))
+
+    # the body of the next window, waiting for it if it has not arrived yet, or None once every window has been handed out
+    def next(self):
+        if len(self.inflight) == 0:
+            return None
+
+        future = self.inflight.popleft()
+        self.fill() # start on the next window while waiting for this one
+
+        return future.result()
+
+    # stop fetching any windows that have not been started
+    def close(self):
+        for future in self.inflight:
+            future.cancel()
+        self.inflight.clear()
+
+        self.executor.shutdown(wait=False)
@@ -2,9 +2,16 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import numpy as np
 import time
+from decimate import minmax
 
 # http://matplotlib.org/examples/animation/simple_anim.html
 # https://jakevdp.github.io/blog/2012/08/18/matplotlib-animation-tutorial/
+# https://matplotlib.org/stable/users/explain/animations/blitting.html
+#
+# When displaying (rather than saving a movie), the lines are blitted: a full draw renders everything but the lines,
+# the background of each subplot is saved from it, and each frame then restores the background of only the subplots
+# whose processor's data changed (going by the version in its get_data result), draws their lines over it and copies
+# just those subplots to the screen.  A full draw is only done when a subplot's limits move.
 class Plotter:
     def __init__(self, processor_threads, xwin=60, xscale=1e6):
         self.pts = processor_threads
@@ -12,16 +19,44 @@ class Plotter:
         self.xwin = xwin
         self.xscale = xscale
         self.axes = []
+        self.blit = False
+        self.backgrounds = [] # the saved background of each subplot, when blitting
+        self.limits = [] # the x and y limits last set on each subplot
+        self.versions = [] # the version of each processor's data as last drawn
 
     def init(self):
-        for j in range(len(self.pts)):
-            for i in range(len(self.pts[j].get_data()['X'])):
-                self.lines[i].set_data([], [])
-        return self.lines,
+        for line in self.lines:
+            line.set_data([], [])
+
+        # when blitting, the lines are drawn by animate itself rather than by the animation
+        if self.blit:
+            return ()
+        else:
+            return self.lines,
+
+    # called at the end of every full draw: save the backgrounds, which leave out the (animated) lines, and draw the lines over them
+    def on_draw(self, event):
+        self.backgrounds = [self.fig.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+
+        for axnum in range(len(self.axes)):
+            self.axes[axnum].draw_artist(self.lines[axnum])
+
+    # redraw the lines of the given subplots over their saved backgrounds
+    def blit_axes(self, axnums):
+        if len(self.backgrounds) < len(self.axes):
+            return # there has not been a full draw yet
+
+        for axnum in axnums:
+            self.fig.canvas.restore_region(self.backgrounds[axnum])
+            self.axes[axnum].draw_artist(self.lines[axnum])
+            self.fig.canvas.blit(self.axes[axnum].bbox)
 
     def start(self, save=False, runtime=120, fps=30, moviefilename='out.mp4'):
         self.fig = plt.figure()
 
+        # a movie is made of full draws of every frame, so only blit when displaying (and if the backend can)
+        self.blit = not save and self.fig.canvas.supports_blit
+
         subplots = 0
 
         for j in range(len(self.pts)):
@@ -44,11 +79,12 @@ class Plotter:
                 self.axes.append(ax)
 
                 xcol = data['X'][i]
-                line, = ax.plot([], [], lw=2)
+                line, = ax.plot([], [], lw=2, animated=self.blit)
                 ax.set_xlabel(data['xlabel'][i])
                 ax.set_ylabel(data['ylabel'][i])
                 ax.set_title(data['title'] + ': ' + data['Y'][i] + ' vs ' + xcol)
                 self.lines.append(line)
+                self.limits.append(None)
                 
                 subplotnum = subplotnum + 1
                 
@@ -63,6 +99,8 @@ class Plotter:
             if 'xwin' in data:
                 if data['xwin'] > self.xwin and data['xwin'] > 0:
                     self.xwin = data['xwin']
+
+            self.versions.append(None)
                 
         self.xscale = maxxscale
 
@@ -74,7 +112,13 @@ class Plotter:
         else:
             nframes=int(runtime)*int(fps)
 
-        self.anim = animation.FuncAnimation(self.fig, self.animate, init_func=self.init, interval=1, frames=nframes, blit=False)
+        if self.blit:
+            self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+            # animate draws its own subplots and returns no artists, so the animation is just the timer that calls it
+            self.anim = animation.FuncAnimation(self.fig, self.animate, init_func=self.init, interval=int(1000 / fps), frames=nframes, blit=True)
+        else:
+            self.anim = animation.FuncAnimation(self.fig, self.animate, init_func=self.init, interval=1, frames=nframes, blit=False)
 
         # enable draw in the background
         plt.ion()
@@ -91,16 +135,26 @@ class Plotter:
 
     def animate(self, step):
         axnum = 0
+        dirty = [] # subplots whose data changed
+        relayout = False # whether any subplot's limits moved
 
         for j in range(len(self.pts)):
             data = self.pts[j].get_data()
+
+            # skip the processor's subplots if its data has not changed since they were drawn
+            version = data.get('version')
+            if self.blit and not (version is None) and version == self.versions[j]:
+                axnum = axnum + len(data['X'])
+                continue
+            self.versions[j] = version
+
             for i in range(len(data['X'])):
                 xcol = data['X'][i]
                 ycol = data['Y'][i]
 
                 X = data['data'][xcol]
                 Y = data['data'][ycol]
-                self.lines[axnum].set_data(X, Y)
+                dirty.append(axnum)
 
                 if len(X) >= 1 or len(Y) >= 1:
                     minx = min(X)
@@ -108,15 +162,20 @@ class Plotter:
                     maxy = max(Y)
                     maxx = max(X)
 
+                    # the limits are padded so that they only move when the data leaves them, rather than with every
+                    # update: the x axis moves forward in steps of a tenth of the window, and the y axis moves when the
+                    # data goes beyond it (or fills less than half of it), to a tenth of the data's range beyond it
+                    step = self.xwin * self.xscale / 10.0
+
                     if maxx < (self.xwin-1) * self.xscale:
                         newxmax = self.xscale * (self.xwin - 1)
-                        newxmin = minx
+                        newxmin = np.floor(minx / step) * step
                     elif maxx - minx > (self.xwin-1) * self.xscale:
-                        newxmax = maxx + self.xscale
-                        newxmin = maxx - self.xwin * self.xscale
+                        newxmax = np.ceil((maxx + self.xscale) / step) * step
+                        newxmin = newxmax - (self.xwin + 1) * self.xscale - step
                     else:
-                        newxmax = maxx + self.xscale
-                        newxmin = minx
+                        newxmax = np.ceil((maxx + self.xscale) / step) * step
+                        newxmin = np.floor(minx / step) * step
 
                     if abs(maxy) > 1:
                         yscale = 1
@@ -126,13 +185,42 @@ class Plotter:
                     newymin = miny - yscale
                     newymax = maxy + yscale
 
-                    self.axes[axnum].set_xlim([newxmin, newxmax])
-                    self.axes[axnum].set_ylim([newymin, newymax])
+                    limits = self.limits[axnum]
+                    if limits is None or newymin < limits[2] or newymax > limits[3] or limits[3] - limits[2] > 2 * (newymax - newymin):
+                        pad = abs(newymax - newymin) / 10.0
+                        newymin = newymin - pad
+                        newymax = newymax + pad
+                    else:
+                        newymin = limits[2]
+                        newymax = limits[3]
+
+                    # only relayout when the limits actually move
+                    if self.limits[axnum] != (newxmin, newxmax, newymin, newymax):
+                        self.limits[axnum] = (newxmin, newxmax, newymin, newymax)
+                        self.axes[axnum].set_xlim([newxmin, newxmax])
+                        self.axes[axnum].set_ylim([newymin, newymax])
+                        relayout = True
+
+                # only a few points can be seen in each column of pixels, so draw just those that matter (see decimate.py)
+                if len(X) == len(Y):
+                    xmin, xmax = self.axes[axnum].get_xlim()
+                    X, Y = minmax(X, Y, xmin, xmax, self.axes[axnum].bbox.width)
+
+                self.lines[axnum].set_data(X, Y)
 
                 #print data['title'], max(X)
 
                 axnum = axnum + 1
 
+        if self.blit:
+            # a full draw redraws every line (in on_draw) along with the new axes; otherwise redraw only the subplots that changed
+            if relayout:
+                self.fig.canvas.draw()
+            else:
+                self.blit_axes(dirty)
+
+            return ()
+
         plt.draw()
         plt.pause(0.1)
         time.sleep(0.25)
@@ -1,15 +1,19 @@
 import threading
+import collections
 import pandas as pd
 import numpy as np
 import math
 from rfidutil import *
+from iotjson import decode_columns, nrows, to_rows
+from tagstore import TagStore, conform, fillnearest
 import filterpy.kalman as kf
 import json
 
 class RSSIEstimator:
     def __init__(self, initial_prior=0, initial_variance=256):
-        self.rssihistory = []
-        self.timehistory = []
+        # only the most recent reading is filtered, so that is all that is kept
+        self.rssihistory = collections.deque(maxlen=1)
+        self.timehistory = collections.deque(maxlen=1)
 
         self.x = initial_prior
         self.P = initial_variance
@@ -30,22 +34,122 @@ class RSSIEstimator:
         #print self.timehistory[-1], estimated_rssi, self.rssihistory[-1]
         return estimated_rssi, self.rssihistory[-1]
 
+# A bank of independent scalar Kalman filters like RSSIEstimator, one for each key (i.e., each epc96, antenna, and
+# channelindex), holding only the current estimate, variance, and time of the last reading for each key.  If
+# Q_per_second is given, the process noise grows with the time since the key's last reading instead of being Q per read.
+class RSSIEstimatorBank:
+    def __init__(self, initial_prior=0, initial_variance=256, Q=2, R=1, Q_per_second=None, timescale=1e6):
+        self.initial_prior = initial_prior
+        self.initial_variance = initial_variance
+        self.Q = Q # rely more on the prediction by using a high Q variance
+        self.R = R # measurement variance could be up to 1 per RSSI read
+        self.Q_per_second = Q_per_second
+        self.timescale = timescale
+
+        self.slots = dict() # key -> index into the state arrays
+        self.x = np.empty(0)
+        self.P = np.empty(0)
+        self.lasttime = np.empty(0)
+
+    def __len__(self):
+        return len(self.slots)
+
+    # the state index of each key, adding state for keys not seen before
+    def lookup(self, keys):
+        slots = np.empty(len(keys), dtype=int)
+
+        for i, key in enumerate(keys):
+            if not (key in self.slots):
+                self.slots[key] = len(self.slots)
+            slots[i] = self.slots[key]
+
+        if len(self.slots) > len(self.x):
+            n = len(self.x)
+            size = max(len(self.slots), 2 * n)
+            self.x = np.concatenate((self.x, np.full(size - n, float(self.initial_prior))))
+            self.P = np.concatenate((self.P, np.full(size - n, float(self.initial_variance))))
+            self.lasttime = np.concatenate((self.lasttime, np.full(size - n, np.nan)))
+
+        return slots
+
+    # filter a batch of readings, where codes[i] is the index into keys of reading i; returns the estimate after each reading
+    def estimate_batch(self, keys, codes, readings, timestamps):
+        readings = np.asarray(readings, dtype=float)
+        timestamps = np.asarray(timestamps, dtype=float)
+        estimates = np.empty(len(readings))
+
+        if len(readings) == 0:
+            return estimates
+
+        slots = self.lookup(keys)[codes]
+
+        # step every key at once: first each key's first reading in the batch, then each key's second reading, and so on
+        rank = pd.Series(codes).groupby(codes).cumcount().values
+        order = np.argsort(rank, kind='stable')
+        bounds = np.searchsorted(rank[order], np.arange(rank.max() + 2))
+
+        for r in range(len(bounds) - 1):
+            rows = order[bounds[r]:bounds[r + 1]]
+            s = slots[rows]
+
+            if self.Q_per_second is None:
+                Q = self.Q
+            else:
+                gap = (timestamps[rows] - self.lasttime[s]) * 1.0 / self.timescale
+                Q = np.where(np.isnan(gap), self.Q, self.Q_per_second * np.maximum(gap, 0))
+
+            Pp = self.P[s] + Q
+            K = Pp * 1.0 / (Pp + self.R)
+            self.x[s] = self.x[s] + K * (readings[rows] - self.x[s])
+            self.P[s] = (1 - K)**2 * Pp + K**2 * self.R # same (Joseph form) update as kf.update
+            self.lasttime[s] = timestamps[rows]
+
+            estimates[rows] = self.x[s]
+
+        return estimates
+
 class Processor(object):
-    def __init__(self, timescale=1e6, debug=False):
+    # retention is the number of seconds of data to keep, and retention_rows the number of rows; None keeps everything
+    def __init__(self, timescale=1e6, debug=False, columnar=True, retention=None, retention_rows=None):
         self.t = threading.Thread(target = self.process_loop, args=())
         self.timescale = timescale
-        self.df = pd.DataFrame(dtype='float')
+        self.columnar = columnar # augment each batch with array operations rather than row by row
+        self.store = TagStore() # backs self.df
         self.max_relative_timestamp = 0
         self.done = False
-        self.rssi_estimator = RSSIEstimator()
+        self.rssi_estimator = RSSIEstimator() # used by augment_rows
         self.prx_m_p_d_estimator = RSSIEstimator()
+        self.rssi_estimators = RSSIEstimatorBank(timescale=timescale) # used by augment_columnar, one filter per epc96, antenna and channelindex
+        self.prx_m_p_d_estimators = RSSIEstimatorBank(timescale=timescale)
         self.lock = threading.Lock()
         self.debug = debug
+        self.source = None # the SharedAugmenter this processor reads from, if any
+        self.version = 0 # incremented whenever the output of get_data changes, so that the plotter can skip redrawing it
+        self.set_retention(retention, retention_rows)
         
     def log(self, msg):
         if self.debug:
             print(msg)
 
+    # the data as a DataFrame indexed by timedeltaindex and sorted by relative_timestamp; its columns are views of self.store
+    @property
+    def df(self):
+        self.acquire_lock()
+
+        df = self.store.frame()
+
+        self.release_lock()
+
+        return df
+
+    @df.setter
+    def df(self, df):
+        self.acquire_lock()
+
+        self.store.reset(df)
+
+        self.release_lock()
+
     def acquire_lock(self):
         self.log("Acquiring Lock")
         
@@ -56,13 +160,45 @@ class Processor(object):
         
         self.lock.release()
         
+    # bound self.df to the most recent seconds of data and/or the most recent rows; older rows are evicted as new data is added
+    def set_retention(self, seconds=None, rows=None):
+        self.acquire_lock()
+
+        if seconds is None:
+            self.store.maxspan = None
+        else:
+            self.store.maxspan = seconds * self.timescale
+        self.store.maxrows = rows
+
+        self.release_lock()
+
+    # read from the store of a SharedAugmenter instead of adding data to a store of our own
+    def share(self, source):
+        self.source = source
+        self.store = source.store
+        self.lock = source.lock
+
+    # whether the data this processor adds is just the augmented batch, so that it can be shared with other processors
+    def shareable(self):
+        return type(self).add_data is Processor.add_data and type(self).augment is Processor.augment and type(self).set_columns is Processor.set_columns and self.columnar
+
+    # whether add_data can be given a batch as a dict of columns rather than a list of row dicts; an add_data that a
+    # subclass overrides was written for rows
+    def takes_columns(self):
+        return type(self).add_data is Processor.add_data
+
     def notify_finished(self):
         self.done = True
 
-    # called by plotter on the main thread to graph data that the processor may wish to output
+    # called by plotter on the main thread to graph data that the processor may wish to output; a result with a version
+    # (read before the data it describes) is only redrawn when its version changes
     def get_data(self):
         pass
 
+    # called by a subclass after changing the data that get_data returns
+    def updated(self):
+        self.version = self.version + 1
+
     # https://stackoverflow.com/questions/6518811/interpolate-nan-values-in-a-numpy-array        
     def interpnan(self, y):
         def helper(y):
@@ -89,17 +225,16 @@ class Processor(object):
         
         return ya
         
+    # fill each missing value with its nearest valid neighbour in the same column (see tagstore.fillnearest) and drop duplicate rows
     def fillna(self, df, maxcount=10000):
         self.acquire_lock()
         
         self.log('fillna')
         
         try:
-            i = 0
-            while df.isnull().values.any() and i < maxcount:
-                df.fillna(method='pad', limit=1, inplace=True) # fill NaN's forward, 1 by 1
-                df.fillna(method='bfill', limit=1, inplace=True) # fill NaN's backward, 1 by 1
-                i = i + 1
+            for col in df.columns:
+                if df[col].isnull().any():
+                    df[col] = fillnearest(df[col].values, maxcount)
                 
             df.drop_duplicates(inplace=True)
         except:
@@ -127,36 +262,94 @@ class Processor(object):
         print(str(timestamp) + ': ' + msg)
         print('**********')
 
+    # the positions of the last of the rows with the earliest relative_timestamp, and of the last of the rows with the
+    # latest, or None if no row has a timestamp; rows sorted by relative_timestamp (i.e., a frame or window of the
+    # store, unless a subclass has reordered it) are found by binary search, and other rows (i.e., resampled ones) are
+    # searched with argmin and argmax
+    def time_extremes(self, rows):
+        if len(rows) == 0 or not ('relative_timestamp' in rows):
+            return None, None
+
+        timestamps = rows['relative_timestamp'].values
+
+        if timestamps.dtype.kind in 'iu' and np.all(timestamps[1:] >= timestamps[:-1]):
+            return int(np.searchsorted(timestamps, timestamps[0], side='right')) - 1, len(timestamps) - 1
+
+        timestamps = timestamps.astype(float)
+        positions = np.flatnonzero(~np.isnan(timestamps))
+
+        if len(positions) == 0:
+            return None, None
+
+        timestamps = timestamps[positions]
+        earliest = positions[len(positions) - 1 - np.argmin(timestamps[::-1])]
+        latest = positions[len(positions) - 1 - np.argmax(timestamps[::-1])]
+
+        return int(earliest), int(latest)
+
+    # the field at the earliest and latest relative_timestamp; as when the rows were scanned from a time of 0, the
+    # field at the earliest time is 0 unless that time is at or before 0, and at the latest unless it is at or after 0
     def get_field_range(self, rows, field):
         self.log('get_field_range')
-        
+
         earlyfield = 0
         recentfield = 0
-        mintime = 0
-        maxtime = 0
-        for i, row in rows.iterrows():
-            if float(row['relative_timestamp']) <= mintime:
-                earlyfield = float(row[field])
-                mintime = float(row['relative_timestamp'])
-            if float(row['relative_timestamp']) >= maxtime:
-                recentfield = float(row[field])
-                maxtime = float(row['relative_timestamp'])
+
+        earliest, latest = self.time_extremes(rows)
+
+        if not (earliest is None) and float(rows['relative_timestamp'].iloc[earliest]) <= 0:
+            earlyfield = float(rows[field].iloc[earliest])
+        if not (latest is None) and float(rows['relative_timestamp'].iloc[latest]) >= 0:
+            recentfield = float(rows[field].iloc[latest])
 
         return earlyfield, recentfield
 
+    # the earliest and latest relative_timestamp, which (as when the rows were scanned from a time of 0) include 0
     def get_time_range(self, rows):
         self.log('get_time_range')
-        
-        maxtime = 0
+
         mintime = 0
-        for i, row in rows.iterrows():
-            if float(row['relative_timestamp']) <= mintime:
-                mintime = float(row['relative_timestamp'])
-            if float(row['relative_timestamp']) >= maxtime:
-                maxtime = float(row['relative_timestamp'])
+        maxtime = 0
+
+        earliest, latest = self.time_extremes(rows)
+
+        if not (earliest is None):
+            mintime = min(mintime, float(rows['relative_timestamp'].iloc[earliest]))
+        if not (latest is None):
+            maxtime = max(maxtime, float(rows['relative_timestamp'].iloc[latest]))
 
         return mintime, maxtime
 
+    # the rows with start <= relative_timestamp < end (either may be None to leave that end open), and optionally only those
+    # of one epc96 and/or antenna; the rows are found by binary search, since the data is sorted by relative_timestamp,
+    # and are a slice of self.df (rather than a copy) unless they are filtered by tag or antenna, in which case they
+    # are looked up in the store's index of each tag's rows
+    def window(self, start=None, end=None, epc=None, antenna=None):
+        values = dict()
+        if not (epc is None):
+            values['epc96'] = epc
+        if not (antenna is None):
+            values['antenna'] = antenna
+
+        self.acquire_lock() # the frame and the positions must come from the same version of the store
+
+        df = self.store.frame()
+        positions = None
+
+        if len(self.store) > 0 and self.store.sortfield in self.store:
+            lo, hi = self.store.bounds(start, end)
+            if len(values) > 0:
+                positions = self.store.select(lo, hi, **values)
+
+        self.release_lock()
+
+        if not ('relative_timestamp' in df):
+            return df
+        elif positions is None:
+            return df.iloc[lo:hi]
+        else:
+            return df.iloc[positions]
+
     # valdict should include the index column and value as this is the row searched by the update in the main dataframe
     def update_fields(self, df, valdict, indexcol):
         self.acquire_lock()
@@ -182,7 +375,95 @@ class Processor(object):
 
     # append columns to the data
     def augment(self, body):
-        self.log('augment')
+        if self.columnar:
+            return self.augment_columnar(body)
+        else:
+            body['data'] = to_rows(body['data']) # i.e., if the data arrived as columns in the binary format
+            return self.augment_rows(body)
+
+    # columnar version of augment_rows: computes the same columns over the whole batch at once, and replaces body['data'] with the resulting DataFrame
+    def augment_columnar(self, body):
+        self.log('augment_columnar')
+
+        # decode the rows and their freeform fields straight into typed columns; a DataFrame has already been decoded (i.e., by a worker process proxy)
+        if isinstance(body['data'], pd.DataFrame):
+            df = body['data'].reset_index(drop=True)
+        else:
+            df = pd.DataFrame(decode_columns(body['data']))
+
+        rssi = df['rssi'].astype(float).values
+        channel = df['channelindex'].astype(float).values # NaN for a missing channel
+        timestamps = df['relative_timestamp'].astype(float).values
+
+        # rows are grouped by their tag, antenna, and channel; keys[groups[i]] is the group of row i
+        groups, keys = pd.factorize(df['epc96'].astype(str) + '|' + df['antenna'].astype(str) + '|' + df['channelindex'].astype(str))
+
+        # compute true doppler in Hz from doppler by converting from two's complement and dividing by 16 to get the 4 fractional bits on the right
+        raw_doppler = df['doppler'].astype(float).values
+        doppler_hz = np.where(raw_doppler > 32767, raw_doppler - 65536, raw_doppler) * 1.0 / 16
+        df['doppler_hz'] = doppler_hz
+
+        # compute estimated rssi for each data point and its distance from the mean and min of each channel burst
+        estimated_rssi = self.rssi_estimators.estimate_batch(keys, groups, rssi, timestamps)
+        df['estimated_rssi'] = estimated_rssi
+
+        burst = pd.Series(estimated_rssi).groupby(groups)
+        df['rssi_from_mean'] = estimated_rssi - burst.transform('mean').values
+        df['rssi_from_min'] = estimated_rssi - burst.transform('min').values
+
+        # a missing channel has no frequency, so the values derived from it are NaN rather than those of some arbitrary channel
+        freq = np.where(np.isnan(channel), np.nan, freqsbychannel(np.where(np.isnan(channel), 0, channel).astype(int)))
+        wavelength = cspeed * 1.0 / freq # lambda
+
+        phase_rads = phase_to_rads(df['phase'].astype(float).values)
+        df['doppler_channel'] = doppler_hz * freq
+        df['phase_rads'] = phase_rads
+        df['phase_cos_rads'] = np.cos(phase_rads)
+
+        # Solve for moving_parts == gtag**2 * R (the return loss) / r**4 (the radius); see augment_rows for the derivation
+        prxLinear = 10**(rssi * 0.1) * 1000 # convert to Watts from dbm
+        ptx = 1 # 1W = 30 dbm power from transmitter
+        gr = 9 # reader gain (constant)
+        prx_moving_parts = (ptx * gr**2) * 1.0 / (prxLinear * (wavelength**4))
+        df['prx_moving_parts'] = 10 * np.log10(prx_moving_parts * 1.0 / 1000)
+
+        xi = 0.00961892564782412 # was 0.009405417 for gain only and not aperature
+        prxval = df['prx_moving_parts'].values + (xi * (50 - channel))
+        df['prx_moving_parts_deoscillated'] = prxval
+
+        df['estimated_prx_m_p_d'] = self.prx_m_p_d_estimators.estimate_batch(keys, groups, prxval, timestamps)
+
+        # velocity from doppler shift
+        df['velocity_by_doppler'] = doppler_hz * cspeed * 1.0 / freq
+
+        # velocity from phase difference against the previous read of the same channel, antenna, and epc96 in this body (CBID paper)
+        byphase = pd.DataFrame({'phase_rads': phase_rads, 'relative_timestamp': timestamps}).groupby(groups).shift(1)
+        prevphase = byphase['phase_rads'].values
+        prevtime = byphase['relative_timestamp'].values
+
+        denominator = 4 * (1/self.timescale) * (timestamps - prevtime) * math.pi
+        deltaphase = phase_rads - prevphase
+        deltaphase = np.where(deltaphase >= 2 * math.pi, deltaphase - 2 * math.pi, deltaphase)
+        deltaphase = np.where(deltaphase < -1 * math.pi, deltaphase + 2 * math.pi, deltaphase)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            velocity_by_phase = np.where(denominator == 0, np.nan, wavelength * deltaphase * 1.0 / denominator)
+
+        df['doppler_by_phase'] = velocity_by_phase * freq * 1.0 / cspeed
+        df['velocity_by_phase'] = velocity_by_phase
+
+        # rssi delta only against the immediately preceding row, and only if it is from the same channel, antenna, and epc96
+        sameasprev = np.concatenate(([False], groups[1:] == groups[:-1]))
+        prevrssi = np.concatenate(([np.nan], rssi[:-1]))
+        df['rssi_delta'] = np.where(sameasprev, rssi - prevrssi, np.nan)
+
+        body['data'] = df
+
+        return body
+
+    # append columns to the data, one row at a time
+    def augment_rows(self, body):
+        self.log('augment_rows')
         
         # these aggregates prefer some data in the body - not just one row, or else the means will always be reported as 0
         rssis = dict()
@@ -297,59 +578,37 @@ class Processor(object):
 
         return body
 
-    def setcolumn(self, df, col, coltype):
+    # add the body to the store, returning the position of the first row that changed
+    def append_data(self, body):
+        bodydf = self.set_columns(pd.DataFrame(body['data']))
+
         self.acquire_lock()
-        
-        self.log('setcolumn')
-        
-        if col not in df:
-            df[col] = np.nan
-        df[col] = df[col].astype(coltype)
-        
+
+        self.log('append_data')
+
+        start = self.store.append(bodydf)
+
         self.release_lock()
-        
-        return df
 
-    def append_data(self, df, body):
+        return start
+
+    # fill missing values and drop duplicates in the rows from start onwards, which are the only ones that have changed since the last fill
+    def fill_from(self, start, maxcount=10000):
         self.acquire_lock()
-        
-        self.log('append_data')
-        
-        bodydf = pd.DataFrame(body['data'])
-        dfs = [df, bodydf]
-        
-        #self.log(dfs)
-        #self.log(bodydf)
-        #self.log(len(body['data']))
-        
-        df = pd.concat(dfs)
-        
+
+        self.log('fill_from')
+
+        try:
+            self.store.fill(start, maxcount)
+            self.store.dedupe(start)
+        except:
+            pass
+
         self.release_lock()
-        
-        return df
 
+    # cast the columns of a batch to the declared schema before it is added to the store
     def set_columns(self, df):
-        self.df = self.setcolumn(self.df, 'antenna', float)
-        self.df = self.setcolumn(self.df, 'channelindex', float)
-        self.df = self.setcolumn(self.df, 'rssi', float)
-        self.df = self.setcolumn(self.df, 'epc96', str)
-        self.df = self.setcolumn(self.df, 'velocity_by_phase', float)
-        self.df = self.setcolumn(self.df, 'rssi_delta', float)
-        self.df = self.setcolumn(self.df, 'rssi_from_mean', float)
-        self.df = self.setcolumn(self.df, 'rssi_from_min', float)
-        self.df = self.setcolumn(self.df, 'doppler_channel', float)
-        self.df = self.setcolumn(self.df, 'phase_rads', float)     
-        self.df = self.setcolumn(self.df, 'doppler_by_phase', float)
-        self.df = self.setcolumn(self.df, 'velocity_by_doppler', float)
-        self.df = self.setcolumn(self.df, 'doppler_hz', float)
-        self.df = self.setcolumn(self.df, 'estimated_rssi', float)
-        self.df = self.setcolumn(self.df, 'prx_moving_parts', float)
-        self.df = self.setcolumn(self.df, 'prx_moving_parts_deoscillated', float)
-        self.df = self.setcolumn(self.df, 'estimated_prx_m_p_d', float)#ADDED by Rob 10-18-17
-        self.df = self.setcolumn(self.df, 'phase_cos_rads', float)
-        self.df = self.setcolumn(self.df, 'prx_filtered', float)
-
-        return self.df
+        return conform(df)
         
     def add_data(self, body):
         self.log('add_data')
@@ -357,23 +616,37 @@ class Processor(object):
         if not 'data' in body:
             return
 
-        if len(body['data']) == 0:
+        if nrows(body['data']) == 0:
             return
 
         body = self.augment(body)
         
         self.log('appending augmented body')        
-        self.df = self.append_data(self.df, body)
-        self.log('setting time delta index')
-        self.df['timedeltaindex'] = pd.to_timedelta(self.df['relative_timestamp'], unit='us')
-        self.log('setting index)')
-        self.df.set_index('timedeltaindex', inplace=True)
-        self.log('sorting')
-        self.df.sort_values(by='relative_timestamp', inplace=True)
+        start = self.append_data(body)
         self.log('setting last max timestamp')
-        last_max_relative_timestamp = self.max_relative_timestamp
-        self.max_relative_timestamp = self.df['relative_timestamp'].max()
+        self.max_relative_timestamp = self.store.max()
+
+        self.fill_from(start)
+
+# Augments each batch once on behalf of a set of processors, which all read the same store, so that memory and the
+# time spent adding data do not grow with the number of processors.  The store's frame is read-only to the processors.
+class SharedAugmenter(Processor):
+    def __init__(self, timescale=1e6, debug=False, retention=None, retention_rows=None):
+        super(SharedAugmenter, self).__init__(timescale=timescale, debug=debug, columnar=True, retention=retention, retention_rows=retention_rows)
+        self.t = None # there is no processing loop
+        self.store.readonly = True
+        self.subscribers = []
 
-        self.df = self.set_columns(self.df)
+    def subscribe(self, pt):
+        pt.share(self)
+        pt.max_relative_timestamp = self.max_relative_timestamp
+        self.subscribers.append(pt)
+
+    def takes_columns(self):
+        return True
+
+    def add_data(self, body):
+        super(SharedAugmenter, self).add_data(body)
 
-        self.df = self.fillna(self.df)
+        for pt in self.subscribers:
+            pt.max_relative_timestamp = self.max_relative_timestamp
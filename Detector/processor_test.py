@@ -16,6 +16,7 @@ class TestProcessor(Processor):
     # return a dict with data, title, xlabel, ylabel, X and Y (X/Y and xlabel/ylabel are parallel arrays of x and y keys to be found within data), and each subkey within data is a parallel array of values
     def get_data(self):
         result = dict()
+        result['version'] = self.version
         result['data'] = dict()
         result['title'] = 'RSSI'
         result['xlabel'] = ['Time']
@@ -43,7 +44,7 @@ class TestProcessor(Processor):
                 continue
              
             try:
-                rows = self.df.query('relative_timestamp >= ' + str(mintime) + ' and relative_timestamp <= ' + str(maxtime))
+                rows = self.window(mintime, maxtime + 1) # relative_timestamp is an integer, so this includes maxtime
             except:
                 continue
          
@@ -52,5 +53,7 @@ class TestProcessor(Processor):
                 
                 self.rssi.append(float(row['rssi']))
                 self.times.append(int(row['relative_timestamp']))       
+
+            self.updated()
              
             time.sleep(1)
\ No newline at end of file
@@ -0,0 +1,234 @@
+import sys
+import getopt
+import json
+import math
+import re
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from iotjson import pack, msgpack, MSGPACK_TYPE, JSON_TYPE, loads
+
+# A stand-in for the IoT Sensor Framework server's /api/iot endpoints, for running the Detector, Visualizer and
+# FusionFramework offline.  It serves either the tag reads in a file (a JSON body with a data list, as saved from the
+# server), or reads that it synthesizes in real time from a handful of tags.  Tag reads are sent in the columnar
+# MessagePack format to clients that accept it, and as JSON otherwise.
+
+# Defaults:
+port = 5000
+host = 'localhost'
+datafile = None
+timescale = int(1e6)
+readrate = 200 # synthesized reads per second
+tags = 4
+do_debug = False
+
+############################################## OPTIONS
+def usage(port, host, datafile, timescale, readrate, tags, do_debug):
+	print('%s [<options>]' % sys.argv[0])
+	print('where <options> are:\n' \
+			'\t-h - show this help message\n' \
+			'\t-o <host> - host name to listen on: default %s\n' \
+			'\t-p <port> - port to listen on: default %s\n' \
+			'\t-f <file> - serve the tag reads in this JSON file rather than synthesizing them: default %s\n' \
+			'\t-t <timescale> - scale of interrogator time (i.e., 1 for 1 unit per second): default %s\n' \
+			'\t-r <reads> - number of reads per second to synthesize: default %s\n' \
+			'\t-n <tags> - number of tags to synthesize: default %s\n' \
+			'\t-d - Enable debugging: default %s\n' % (host, port, datafile, timescale, readrate, tags, do_debug))
+	sys.exit(1)
+
+def getopts():
+    global port
+    global host
+    global datafile
+    global timescale
+    global readrate
+    global tags
+    global do_debug
+
+    optlist, argslist = getopt.getopt(sys.argv[1:], 'ho:p:f:t:r:n:d')
+
+    for opt in optlist:
+        if opt[0] == '-h':
+            usage(port, host, datafile, timescale, readrate, tags, do_debug)
+        if opt[0] == '-o':
+            host = opt[1]
+        if opt[0] == '-p':
+            port = int(opt[1])
+        if opt[0] == '-f':
+            datafile = opt[1]
+        if opt[0] == '-t':
+            timescale = int(opt[1])
+        if opt[0] == '-r':
+            readrate = float(opt[1])
+        if opt[0] == '-n':
+            tags = int(opt[1])
+        if opt[0] == '-d':
+            do_debug = True
+
+############################################## MAIN AND HELPERS
+def log(msg):
+    global do_debug
+
+    if do_debug:
+        print(msg)
+
+# the tag reads served, sorted by relative_timestamp; synthesized reads are generated up to the present on each request
+class TagReads(object):
+    def __init__(self, rows=None, readrate=200, tags=4, timescale=1e6):
+        self.lock = threading.Lock()
+        self.timescale = timescale
+        self.readrate = readrate
+        self.epcs = ['E20000000000000000000' + ('%03X' % i) for i in range(tags)]
+        self.started = time.time()
+        self.nextread = 0 # number of reads synthesized so far
+
+        if rows is None:
+            self.synthesize = True
+            self.rows = []
+        else:
+            self.synthesize = False
+            self.rows = sorted(rows, key=lambda row: int(row['relative_timestamp']))
+
+    # a read of one of the tags, whose signal strength and phase follow it moving slowly back and forth
+    def read(self, n):
+        ts = int(n * self.timescale / self.readrate)
+        seconds = ts * 1.0 / self.timescale
+        tag = n % len(self.epcs)
+        channel = 1 + (n // 50) % 50
+        motion = math.sin(2 * math.pi * 0.25 * seconds + tag)
+        freeform = json.dumps(json.dumps({'xval': motion, 'yval': tag})) # the server double encodes freeform
+
+        return {'relative_timestamp': ts, 'epc96': self.epcs[tag], 'antenna': 1 + tag % 2, 'channelindex': channel,
+                'rssi': -55 + 5 * motion + random.gauss(0, 0.5), 'phase': int(2048 + 2047 * motion) % 4096,
+                'doppler': int(16 * 4 * motion) % 65536, 'freeform': freeform}
+
+    def generate(self):
+        if self.synthesize:
+            upto = int((time.time() - self.started) * self.readrate)
+            while self.nextread < upto:
+                self.rows.append(self.read(self.nextread))
+                self.nextread = self.nextread + 1
+
+    def maxtime(self):
+        if len(self.rows) == 0:
+            return 0
+        return int(self.rows[-1]['relative_timestamp'])
+
+    # the reads with start <= relative_timestamp < end
+    def between(self, start, end):
+        self.lock.acquire()
+        try:
+            self.generate()
+            return [row for row in self.rows if start <= int(row['relative_timestamp']) < end]
+        finally:
+            self.lock.release()
+
+    def since(self, start):
+        return self.between(start, float('inf'))
+
+    def last(self, seconds):
+        self.lock.acquire()
+        try:
+            self.generate()
+            maxtime = self.maxtime()
+        finally:
+            self.lock.release()
+
+        return self.between(maxtime - seconds * self.timescale, float('inf'))
+
+    def stats(self):
+        self.lock.acquire()
+        try:
+            self.generate()
+            return [{'max_relative_timestamp': self.maxtime()}]
+        finally:
+            self.lock.release()
+
+class StandinHandler(BaseHTTPRequestHandler):
+    reads = None
+
+    def log_message(self, format, *args):
+        log(format % args)
+
+    def send_body(self, body):
+        accept = self.headers.get('Accept', '')
+
+        if not (msgpack is None) and MSGPACK_TYPE in accept:
+            content = pack(body)
+            contenttype = MSGPACK_TYPE
+        else:
+            content = json.dumps(body).encode('utf-8')
+            contenttype = JSON_TYPE
+
+        self.send_response(200)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def route(self):
+        path = self.path.rstrip('/')
+        reads = StandinHandler.reads
+
+        if path == '/api/iot/maxtime':
+            return {'data': reads.stats()}
+
+        match = re.match(r'^/api/iot(/stats)?/seconds/([0-9.]+)$', path)
+        if match:
+            return {'data': reads.last(float(match.group(2)))}
+
+        match = re.match(r'^/api/iot/(-?[0-9.]+)/(-?[0-9.]+)$', path)
+        if match:
+            return {'data': reads.between(float(match.group(1)), float(match.group(2)))}
+
+        match = re.match(r'^/api/iot/(-?[0-9.]+)$', path)
+        if match:
+            return {'data': reads.since(float(match.group(1)))}
+
+        return None
+
+    def respond(self):
+        # the request body (with the database password) is not checked, but is read so that the connection can be reused
+        length = int(self.headers.get('Content-Length', 0))
+        if length > 0:
+            self.rfile.read(length)
+
+        body = self.route()
+
+        if body is None:
+            self.send_error(404)
+        else:
+            self.send_body(body)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+def run():
+    global port
+    global host
+    global datafile
+    global timescale
+    global readrate
+    global tags
+
+    if datafile is None:
+        rows = None
+    else:
+        with open(datafile, 'rb') as f:
+            rows = loads(f.read())['data']
+
+    StandinHandler.reads = TagReads(rows=rows, readrate=readrate, tags=tags, timescale=timescale)
+    StandinHandler.protocol_version = 'HTTP/1.1' # keep connections alive
+
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    print('Serving on http://' + host + ':' + str(port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    getopts()
+
+    run()
@@ -0,0 +1,189 @@
+import sys
+import os
+import pickle
+import threading
+import importlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+from iotjson import decode_columns, nrows
+
+# Runs a processor in its own worker process, so that processors do not contend with one another (or with
+# fetching and plotting) for the interpreter lock.  The proxy stands in for the processor in the detector: batches
+# passed to add_data are sent to the worker through a pipe, and get_data asks the worker for the processor's
+# current output over a second pipe, so that the plotter is never held up behind a batch being added.  A request for
+# get_data carries the version of the result the proxy already has, and if the processor's result still has that
+# version, the worker answers with an empty message rather than sending the same result again.
+#
+# Batches and results are sent as pickles of columns rather than of rows: numeric columns become numpy arrays,
+# whose contents are written as raw bytes, and the remaining columns become lists of values.
+
+# encode tag reads as a dict of typed columns, with their freeform fields already decoded
+def encode_rows(data):
+    return pickle.dumps(decode_columns(data), protocol=pickle.HIGHEST_PROTOCOL)
+
+def is_number(v):
+    return isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool)
+
+def encode_values(values):
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iuf':
+        return values
+
+    # numpy numbers (as from the columnar path) are packed along with python ones, but bools are left as they are,
+    # since numpy would otherwise treat them as numbers
+    values = list(values)
+    if all(is_number(v) for v in values):
+        return np.asarray(values)
+    else:
+        return values
+
+# encode the result of get_data, whose 'data' entries are parallel sequences of values
+def encode_result(result):
+    if isinstance(result, dict) and isinstance(result.get('data'), dict):
+        result = dict(result)
+        result['data'] = dict((key, encode_values(values)) for key, values in result['data'].items())
+
+    return pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+def decode(payload):
+    return pickle.loads(payload)
+
+def result_version(result):
+    if isinstance(result, dict) and 'version' in result:
+        return result['version']
+    else:
+        return None
+
+# the body of a worker process: instantiate the processor and add each batch that arrives on datapipe,
+# acknowledging it once added, while a thread answers requests for get_data on resultpipe
+def worker_main(cwd, modulename, classname, retention, retention_rows, datapipe, resultpipe):
+    sys.path.insert(0, cwd) # import from the detector's current directory
+
+    ptclass = getattr(importlib.import_module(modulename), classname)
+    pt = ptclass()
+    pt.set_retention(retention, retention_rows)
+    pt.start_thread()
+
+    def serve_results():
+        while 1:
+            try:
+                known = decode(resultpipe.recv_bytes()) # the version of the result that the proxy has, if any
+            except EOFError:
+                break
+
+            try:
+                result = pt.get_data()
+                version = result_version(result)
+                if not (version is None) and version == known:
+                    resultpipe.send_bytes(b'')
+                else:
+                    resultpipe.send_bytes(encode_result(result))
+            except Exception as e:
+                resultpipe.send_bytes(pickle.dumps(e))
+
+    t = threading.Thread(target=serve_results, args=())
+    t.daemon = True
+    t.start()
+
+    while 1:
+        try:
+            payload = datapipe.recv_bytes()
+        except EOFError:
+            break
+
+        if len(payload) == 0: # finished
+            break
+
+        try:
+            cols = decode(payload)
+            if pt.columnar:
+                body = {'data': pd.DataFrame(cols)}
+            else:
+                body = {'data': pd.DataFrame(cols).to_dict('records')}
+            pt.add_data(body)
+            datapipe.send_bytes(b'')
+        except Exception as e:
+            datapipe.send_bytes(pickle.dumps(e))
+
+    pt.notify_finished()
+    pt.join_thread()
+
+# stands in for a processor running in a worker process, with the methods that the detector and plotter call
+class ProcessorProxy(object):
+    def __init__(self, processor, retention=None, retention_rows=None):
+        self.name = processor
+        self.retention = retention
+        self.retention_rows = retention_rows
+
+        self.datapipe, workerdatapipe = multiprocessing.Pipe()
+        self.resultpipe, workerresultpipe = multiprocessing.Pipe()
+        self.datalock = threading.Lock()
+        self.resultlock = threading.Lock()
+
+        self.workerpipes = (workerdatapipe, workerresultpipe)
+        self.process = None
+        self.result = None # the last result of get_data, which is returned again while its version is current
+
+    def start_thread(self):
+        modulename, classname = self.name.split(".")[0], self.name.split(".")[1]
+        self.process = multiprocessing.Process(target=worker_main, args=(os.getcwd(), modulename, classname, self.retention, self.retention_rows) + self.workerpipes)
+        self.process.daemon = True
+        self.process.start()
+
+    # takes effect when the worker is started
+    def set_retention(self, seconds=None, rows=None):
+        self.retention = seconds
+        self.retention_rows = rows
+
+    # the batch is sent to the worker as columns, and handed to the processor there as rows unless it is columnar
+    def takes_columns(self):
+        return True
+
+    # returns once the worker has added the batch, so that a slow worker holds back its own queue of batches
+    def add_data(self, body):
+        data = body['data']
+        if isinstance(data, pd.DataFrame):
+            data = data.to_dict('records')
+
+        if nrows(data) == 0:
+            return
+
+        self.datalock.acquire()
+        try:
+            self.datapipe.send_bytes(encode_rows(data))
+            ack = self.datapipe.recv_bytes()
+        finally:
+            self.datalock.release()
+
+        if len(ack) > 0:
+            raise decode(ack)
+
+    def get_data(self):
+        self.resultlock.acquire()
+        try:
+            self.resultpipe.send_bytes(pickle.dumps(result_version(self.result)))
+            payload = self.resultpipe.recv_bytes()
+
+            if len(payload) > 0:
+                result = decode(payload)
+                if not isinstance(result, Exception):
+                    self.result = result
+            else:
+                result = self.result
+        finally:
+            self.resultlock.release()
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    def notify_finished(self):
+        self.datalock.acquire()
+        try:
+            self.datapipe.send_bytes(b'')
+        finally:
+            self.datalock.release()
+
+    def join_thread(self):
+        self.process.join()
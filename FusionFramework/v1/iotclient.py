@@ -0,0 +1,56 @@
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# An HTTP client for the IoT Sensor Framework server that keeps its connections alive between polls, so that
+# each request does not pay for a new TCP and TLS handshake.  Requests that fail to connect, or that the server
+# answers with a gateway error, are retried with an exponential backoff, and every request is bounded by a timeout.
+class IoTClient(object):
+    # certfile is the path to the certificate file for verifying the server, or NONE to bypass verification
+    # timeout is the number of seconds to wait for the server to connect or respond
+    # retries is the number of times to retry a failed request, waiting backoff * 2^n seconds before retry n
+    # poolsize is the number of connections kept open to the server, which should cover the number of threads polling it
+    # compress is whether to ask the server to gzip its responses (they are decoded transparently)
+    def __init__(self, certfile='NONE', timeout=10, retries=3, backoff=0.25, poolsize=10, compress=True):
+        self.timeout = timeout
+
+        self.session = requests.Session()
+
+        if certfile == 'NONE':
+            self.session.verify = False
+        else:
+            self.session.verify = certfile
+
+        # all of the server's endpoints are reads, even those sent as a POST, so they are safe to retry
+        retryargs = dict(total=retries, backoff_factor=backoff, status_forcelist=(502, 503, 504), raise_on_status=False)
+        try:
+            retry = Retry(allowed_methods=None, **retryargs)
+        except TypeError: # urllib3 < 1.26
+            retry = Retry(method_whitelist=False, **retryargs)
+
+        adapter = HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if compress:
+            self.session.headers['Accept-Encoding'] = 'gzip'
+        else:
+            self.session.headers['Accept-Encoding'] = 'identity'
+
+    def sendhttp(self, url, headerdict=dict(), bodydict=dict(), method='POST'):
+        response = self.session.request(method.upper(), url, data=json.dumps(bodydict), headers=headerdict, timeout=self.timeout)
+
+        return response, self.content(response)
+
+    # the body of a response: text for JSON and other text, or bytes for a binary format (such as MessagePack), which would be garbled as text
+    def content(self, response):
+        contenttype = response.headers.get('Content-Type', '')
+
+        if contenttype == '' or contenttype.startswith('text/') or 'json' in contenttype:
+            return response.text
+        else:
+            return response.content
+
+    def close(self):
+        self.session.close()
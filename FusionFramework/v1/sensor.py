@@ -1,4 +1,5 @@
 import threading
+import collections
 import pandas as pd
 import numpy as np
 import math
@@ -10,12 +11,15 @@ from statsmodels.tsa.arima_model import ARIMA
 #from statsmodels.graphics.tsaplots import plot_acf
 from scipy import stats
 from rfidutil import *
+from iotjson import decode_columns, nrows, to_rows
+from tagstore import TagStore, conform
 import json
 
 class RSSIEstimator:
     def __init__(self, initial_prior=0, initial_variance=256):
-        self.rssihistory = []
-        self.timehistory = []
+        # only the most recent reading is filtered, so that is all that is kept
+        self.rssihistory = collections.deque(maxlen=1)
+        self.timehistory = collections.deque(maxlen=1)
 
         self.x = initial_prior
         self.P = initial_variance
@@ -36,20 +40,109 @@ class RSSIEstimator:
         #print self.timehistory[-1], estimated_rssi, self.rssihistory[-1]
         return estimated_rssi, self.rssihistory[-1]
 
+# A bank of independent scalar Kalman filters like RSSIEstimator, one for each key (i.e., each epc96, antenna, and
+# channelindex), holding only the current estimate, variance, and time of the last reading for each key.  If
+# Q_per_second is given, the process noise grows with the time since the key's last reading instead of being Q per read.
+class RSSIEstimatorBank:
+    def __init__(self, initial_prior=0, initial_variance=256, Q=2, R=1, Q_per_second=None, timescale=1e6):
+        self.initial_prior = initial_prior
+        self.initial_variance = initial_variance
+        self.Q = Q # rely more on the prediction by using a high Q variance
+        self.R = R # measurement variance could be up to 1 per RSSI read
+        self.Q_per_second = Q_per_second
+        self.timescale = timescale
+
+        self.slots = dict() # key -> index into the state arrays
+        self.x = np.empty(0)
+        self.P = np.empty(0)
+        self.lasttime = np.empty(0)
+
+    def __len__(self):
+        return len(self.slots)
+
+    # the state index of each key, adding state for keys not seen before
+    def lookup(self, keys):
+        slots = np.empty(len(keys), dtype=int)
+
+        for i, key in enumerate(keys):
+            if not (key in self.slots):
+                self.slots[key] = len(self.slots)
+            slots[i] = self.slots[key]
+
+        if len(self.slots) > len(self.x):
+            n = len(self.x)
+            size = max(len(self.slots), 2 * n)
+            self.x = np.concatenate((self.x, np.full(size - n, float(self.initial_prior))))
+            self.P = np.concatenate((self.P, np.full(size - n, float(self.initial_variance))))
+            self.lasttime = np.concatenate((self.lasttime, np.full(size - n, np.nan)))
+
+        return slots
+
+    # filter a batch of readings, where codes[i] is the index into keys of reading i; returns the estimate after each reading
+    def estimate_batch(self, keys, codes, readings, timestamps):
+        readings = np.asarray(readings, dtype=float)
+        timestamps = np.asarray(timestamps, dtype=float)
+        estimates = np.empty(len(readings))
+
+        if len(readings) == 0:
+            return estimates
+
+        slots = self.lookup(keys)[codes]
+
+        # step every key at once: first each key's first reading in the batch, then each key's second reading, and so on
+        rank = pd.Series(codes).groupby(codes).cumcount().values
+        order = np.argsort(rank, kind='stable')
+        bounds = np.searchsorted(rank[order], np.arange(rank.max() + 2))
+
+        for r in range(len(bounds) - 1):
+            rows = order[bounds[r]:bounds[r + 1]]
+            s = slots[rows]
+
+            if self.Q_per_second is None:
+                Q = self.Q
+            else:
+                gap = (timestamps[rows] - self.lasttime[s]) * 1.0 / self.timescale
+                Q = np.where(np.isnan(gap), self.Q, self.Q_per_second * np.maximum(gap, 0))
+
+            Pp = self.P[s] + Q
+            K = Pp * 1.0 / (Pp + self.R)
+            self.x[s] = self.x[s] + K * (readings[rows] - self.x[s])
+            self.P[s] = (1 - K)**2 * Pp + K**2 * self.R # same (Joseph form) update as kf.update
+            self.lasttime[s] = timestamps[rows]
+
+            estimates[rows] = self.x[s]
+
+        return estimates
 
 class Sensor(object):
-    def __init__(self, timescale=1e6, debug=False):
+    def __init__(self, timescale=1e6, debug=False, columnar=True):
         self.timescale = timescale
-        self.df = pd.DataFrame(dtype='float')
+        self.columnar = columnar # augment each batch with array operations rather than row by row
+        self.store = TagStore() # backs self.df
         self.max_relative_timestamp = 0
-        self.rssi_estimator = RSSIEstimator()
+        self.rssi_estimator = RSSIEstimator() # used by augment_rows
         self.prx_m_p_d_estimator = RSSIEstimator()
+        self.rssi_estimators = RSSIEstimatorBank(timescale=timescale) # used by augment_columnar, one filter per epc96, antenna and channelindex
+        self.prx_m_p_d_estimators = RSSIEstimatorBank(timescale=timescale)
         self.debug = debug
+        self.streaming = False # whether batches are consecutive chunks of one recording (see add_chunks)
+        self.prevrow = None # when streaming, the last read of the previous chunk, and the last read of each epc96, antenna and channelindex so far
+        self.prevreads = dict()
+        self.bursts = dict() # when streaming, the sum, count, and minimum of the estimated rssi of each channel burst so far
         
     def log(self, msg):
         if self.debug:
             print(msg)
 
+    # the data as a DataFrame indexed by timedeltaindex and sorted by relative_timestamp; its columns are views of self.store
+    @property
+    def df(self):
+        return self.store.frame()
+
+    @df.setter
+    def df(self, df):
+        self.store.reset(df)
+
     # https://stackoverflow.com/questions/6518811/interpolate-nan-values-in-a-numpy-array        
     def interpnan(self, y):
         def helper(y):
@@ -106,36 +199,90 @@ class Sensor(object):
         print(str(timestamp) + ': ' + msg)
         print('**********')
 
+    # the positions of the last of the rows with the earliest relative_timestamp, and of the last of the rows with the
+    # latest, or None if no row has a timestamp; rows sorted by relative_timestamp (i.e., a frame or window of the
+    # store, unless a subclass has reordered it) are found by binary search, and other rows (i.e., resampled ones) are
+    # searched with argmin and argmax
+    def time_extremes(self, rows):
+        if len(rows) == 0 or not ('relative_timestamp' in rows):
+            return None, None
+
+        timestamps = rows['relative_timestamp'].values
+
+        if timestamps.dtype.kind in 'iu' and np.all(timestamps[1:] >= timestamps[:-1]):
+            return int(np.searchsorted(timestamps, timestamps[0], side='right')) - 1, len(timestamps) - 1
+
+        timestamps = timestamps.astype(float)
+        positions = np.flatnonzero(~np.isnan(timestamps))
+
+        if len(positions) == 0:
+            return None, None
+
+        timestamps = timestamps[positions]
+        earliest = positions[len(positions) - 1 - np.argmin(timestamps[::-1])]
+        latest = positions[len(positions) - 1 - np.argmax(timestamps[::-1])]
+
+        return int(earliest), int(latest)
+
+    # the field at the earliest and latest relative_timestamp; as when the rows were scanned from a time of 0, the
+    # field at the earliest time is 0 unless that time is at or before 0, and at the latest unless it is at or after 0
     def get_field_range(self, rows, field):
         self.log('get_field_range')
-        
+
         earlyfield = 0
         recentfield = 0
-        mintime = 0
-        maxtime = 0
-        for i, row in rows.iterrows():
-            if float(row['relative_timestamp']) <= mintime:
-                earlyfield = float(row[field])
-                mintime = float(row['relative_timestamp'])
-            if float(row['relative_timestamp']) >= maxtime:
-                recentfield = float(row[field])
-                maxtime = float(row['relative_timestamp'])
+
+        earliest, latest = self.time_extremes(rows)
+
+        if not (earliest is None) and float(rows['relative_timestamp'].iloc[earliest]) <= 0:
+            earlyfield = float(rows[field].iloc[earliest])
+        if not (latest is None) and float(rows['relative_timestamp'].iloc[latest]) >= 0:
+            recentfield = float(rows[field].iloc[latest])
 
         return earlyfield, recentfield
 
+    # the earliest and latest relative_timestamp, which (as when the rows were scanned from a time of 0) include 0
     def get_time_range(self, rows):
         self.log('get_time_range')
-        
-        maxtime = 0
+
         mintime = 0
-        for i, row in rows.iterrows():
-            if float(row['relative_timestamp']) <= mintime:
-                mintime = float(row['relative_timestamp'])
-            if float(row['relative_timestamp']) >= maxtime:
-                maxtime = float(row['relative_timestamp'])
+        maxtime = 0
+
+        earliest, latest = self.time_extremes(rows)
+
+        if not (earliest is None):
+            mintime = min(mintime, float(rows['relative_timestamp'].iloc[earliest]))
+        if not (latest is None):
+            maxtime = max(maxtime, float(rows['relative_timestamp'].iloc[latest]))
 
         return mintime, maxtime
 
+    # the rows with start <= relative_timestamp < end (either may be None to leave that end open), and optionally only those
+    # of one epc96 and/or antenna; the rows are found by binary search, since the data is sorted by relative_timestamp,
+    # and are a slice of self.df (rather than a copy) unless they are filtered by tag or antenna, in which case they
+    # are looked up in the store's index of each tag's rows
+    def window(self, start=None, end=None, epc=None, antenna=None):
+        values = dict()
+        if not (epc is None):
+            values['epc96'] = epc
+        if not (antenna is None):
+            values['antenna'] = antenna
+
+        df = self.store.frame()
+        positions = None
+
+        if len(self.store) > 0 and self.store.sortfield in self.store:
+            lo, hi = self.store.bounds(start, end)
+            if len(values) > 0:
+                positions = self.store.select(lo, hi, **values)
+
+        if not ('relative_timestamp' in df):
+            return df
+        elif positions is None:
+            return df.iloc[lo:hi]
+        else:
+            return df.iloc[positions]
+
     # valdict should include the index column and value as this is the row searched by the update in the main dataframe
     def update_fields(self, df, valdict, indexcol):        
         self.log('update_fields')
@@ -146,7 +293,120 @@ class Sensor(object):
         
     # append columns to the data
     def augment(self, body):
-        self.log('augment')
+        if self.columnar:
+            return self.augment_columnar(body)
+        else:
+            body['data'] = to_rows(body['data']) # i.e., if the data arrived as columns in the binary format
+            return self.augment_rows(body)
+
+    # columnar version of augment_rows: computes the same columns over the whole batch at once, and replaces body['data'] with the resulting DataFrame
+    def augment_columnar(self, body):
+        self.log('augment_columnar')
+
+        # decode the rows and their freeform fields straight into typed columns; a DataFrame has already been decoded (i.e., by a worker process proxy)
+        if isinstance(body['data'], pd.DataFrame):
+            df = body['data'].reset_index(drop=True)
+        else:
+            df = pd.DataFrame(decode_columns(body['data']))
+
+        rssi = df['rssi'].astype(float).values
+        channel = df['channelindex'].astype(float).values # NaN for a missing channel
+        timestamps = df['relative_timestamp'].astype(float).values
+
+        # rows are grouped by their tag, antenna, and channel; keys[groups[i]] is the group of row i
+        groups, keys = pd.factorize(df['epc96'].astype(str) + '|' + df['antenna'].astype(str) + '|' + df['channelindex'].astype(str))
+
+        # compute true doppler in Hz from doppler by converting from two's complement and dividing by 16 to get the 4 fractional bits on the right
+        raw_doppler = df['doppler'].astype(float).values
+        doppler_hz = np.where(raw_doppler > 32767, raw_doppler - 65536, raw_doppler) * 1.0 / 16
+        df['doppler_hz'] = doppler_hz
+
+        # compute estimated rssi for each data point and its distance from the mean and min of each channel burst
+        estimated_rssi = self.rssi_estimators.estimate_batch(keys, groups, rssi, timestamps)
+        df['estimated_rssi'] = estimated_rssi
+
+        burst = pd.Series(estimated_rssi).groupby(groups)
+        df['rssi_from_mean'] = estimated_rssi - burst.transform('mean').values
+        df['rssi_from_min'] = estimated_rssi - burst.transform('min').values
+
+        if self.streaming:
+            df['estimated_rssi_residual'] = estimated_rssi - estimated_rssi.astype('float32') # see burst_stats
+            firsts = np.unique(groups, return_index=True)[1]
+            sums, counts, mins = burst.sum().values, burst.count().values, burst.min().values
+            for group, row in enumerate(firsts):
+                self.add_burst(self.burstkey(df['epc96'].values[row], df['antenna'].values[row], df['channelindex'].values[row]), sums[group], counts[group], mins[group])
+
+        # a missing channel has no frequency, so the values derived from it are NaN rather than those of some arbitrary channel
+        freq = np.where(np.isnan(channel), np.nan, freqsbychannel(np.where(np.isnan(channel), 0, channel).astype(int)))
+        wavelength = cspeed * 1.0 / freq # lambda
+
+        phase_rads = phase_to_rads(df['phase'].astype(float).values)
+        df['doppler_channel'] = doppler_hz * freq
+        df['phase_rads'] = phase_rads
+        df['phase_cos_rads'] = np.cos(phase_rads)
+
+        # Solve for moving_parts == gtag**2 * R (the return loss) / r**4 (the radius); see augment_rows for the derivation
+        prxLinear = 10**(rssi * 0.1) * 1000 # convert to Watts from dbm
+        ptx = 1 # 1W = 30 dbm power from transmitter
+        gr = 9 # reader gain (constant)
+        prx_moving_parts = (ptx * gr**2) * 1.0 / (prxLinear * (wavelength**4))
+        df['prx_moving_parts'] = 10 * np.log10(prx_moving_parts * 1.0 / 1000)
+
+        xi = 0.00961892564782412 # was 0.009405417 for gain only and not aperature
+        prxval = df['prx_moving_parts'].values + (xi * (50 - channel))
+        df['prx_moving_parts_deoscillated'] = prxval
+
+        df['estimated_prx_m_p_d'] = self.prx_m_p_d_estimators.estimate_batch(keys, groups, prxval, timestamps)
+
+        # velocity from doppler shift
+        df['velocity_by_doppler'] = doppler_hz * cspeed * 1.0 / freq
+
+        # velocity from phase difference against the previous read of the same channel, antenna, and epc96 in this body (CBID paper)
+        byphase = pd.DataFrame({'phase_rads': phase_rads, 'relative_timestamp': timestamps}).groupby(groups).shift(1)
+        prevphase = np.array(byphase['phase_rads'].values, dtype=float)
+        prevtime = np.array(byphase['relative_timestamp'].values, dtype=float)
+
+        # when streaming, the first read of each group in this chunk follows the group's last read in the chunks before
+        if self.streaming:
+            firstrows = np.unique(groups, return_index=True)[1]
+            for group, row in enumerate(firstrows):
+                if keys[group] in self.prevreads:
+                    prevphase[row], prevtime[row] = self.prevreads[keys[group]]
+
+            lastrows = len(groups) - 1 - np.unique(groups[::-1], return_index=True)[1]
+            for group, row in enumerate(lastrows):
+                self.prevreads[keys[group]] = (phase_rads[row], timestamps[row])
+
+        denominator = 4 * (1/self.timescale) * (timestamps - prevtime) * math.pi
+        deltaphase = phase_rads - prevphase
+        deltaphase = np.where(deltaphase >= 2 * math.pi, deltaphase - 2 * math.pi, deltaphase)
+        deltaphase = np.where(deltaphase < -1 * math.pi, deltaphase + 2 * math.pi, deltaphase)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            velocity_by_phase = np.where(denominator == 0, np.nan, wavelength * deltaphase * 1.0 / denominator)
+
+        df['doppler_by_phase'] = velocity_by_phase * freq * 1.0 / cspeed
+        df['velocity_by_phase'] = velocity_by_phase
+
+        # rssi delta only against the immediately preceding row, and only if it is from the same channel, antenna, and epc96
+        sameasprev = np.concatenate(([False], groups[1:] == groups[:-1]))
+        prevrssi = np.concatenate(([np.nan], rssi[:-1]))
+
+        if self.streaming:
+            if not (self.prevrow is None) and self.prevrow[0] == keys[groups[0]]:
+                sameasprev[0] = True
+                prevrssi[0] = self.prevrow[1]
+            self.prevrow = (keys[groups[-1]], rssi[-1])
+
+        df['rssi_delta'] = np.where(sameasprev, rssi - prevrssi, np.nan)
+
+        body['data'] = df
+
+        return body
+
+    # append columns to the data, one row at a time
+    def augment_rows(self, body):
+        self.log('augment_rows')
         
         prxwnd = []
         
@@ -184,6 +444,13 @@ class Sensor(object):
             
         prevrow = None
         prevreads = dict()
+        if self.streaming:
+            prevrow = self.prevrow
+            prevreads = self.prevreads
+
+            for key in rssis:
+                channelindex, antenna, epc96 = key.split('|', 2)
+                self.add_burst(self.burstkey(epc96, antenna, channelindex), sum(rssis[key]), len(rssis[key]), min(rssis[key]))
         
         for row in body['data']:
             # rssi from mean, doppler by channel, and phase to radians
@@ -193,6 +460,8 @@ class Sensor(object):
             phase_rads = phase_to_rads(float(row['phase']))
 
             row['rssi_from_mean'] = rssi_from_mean
+            if self.streaming:
+                row['estimated_rssi_residual'] = float(row['estimated_rssi']) - float(np.float32(row['estimated_rssi'])) # see burst_stats
             row['rssi_from_min'] = rssi_from_min
             row['doppler_channel'] = doppler_channel
             row['phase_rads'] = phase_rads
@@ -263,53 +532,44 @@ class Sensor(object):
             prevrow = row
             prevreads[str(row['channelindex'] + '|' + row['antenna'] + '|' + row['epc96'])] = row
 
-        return body
+        if self.streaming:
+            self.prevrow = prevrow
 
-    def setcolumn(self, df, col, coltype):        
-        self.log('setcolumn')
-        
-        if col not in df:
-            df[col] = np.nan
-        df[col] = df[col].astype(coltype)
-                
-        return df
+        return body
 
-    def append_data(self, df, body):        
+    # add the body to the store, returning the position of the first row that changed
+    def append_data(self, body, filterfield=None, filtervalue=None):
         self.log('append_data')
-        
+
         bodydf = pd.DataFrame(body['data'])
-        dfs = [df, bodydf]
-        
-        #self.log(dfs)
-        #self.log(bodydf)
-        #self.log(len(body['data']))
-        
-        df = pd.concat(dfs)
-                
-        return df
 
+        # the latest time is that of every read, including those that the filter drops
+        self.max_relative_timestamp = max(self.max_relative_timestamp, bodydf['relative_timestamp'].astype('int64').max())
+
+        bodydf = self.set_columns(bodydf)
+
+        if not (filterfield is None) and not (filtervalue is None):
+            bodydf = bodydf[bodydf[filterfield] == self.castvalue(bodydf[filterfield], filtervalue)]
+
+        return self.store.append(bodydf)
+
+    # a filter value cast as the column's values were (i.e., an antenna of '1' or 1.0 as the int16 1), so that it matches
+    # them however the reads arrived; a value that cannot be cast is compared as it is
+    def castvalue(self, values, value):
+        try:
+            return pd.Series([value]).astype(values.dtype).iloc[0]
+        except (TypeError, ValueError):
+            return value
+
+    # fill missing values in the rows from start onwards, using the row before them as well
+    def fill_from(self, start):
+        start = max(0, start - 1)
+
+        self.store.splice(start, self.fillna(self.store.tail(start)))
+
+    # cast the columns of a batch to the declared schema before it is added to the store
     def set_columns(self, df):
-        self.df = self.setcolumn(self.df, 'antenna', float)
-        self.df = self.setcolumn(self.df, 'channelindex', float)
-        self.df = self.setcolumn(self.df, 'rssi', float)
-        self.df = self.setcolumn(self.df, 'epc96', str)
-        self.df = self.setcolumn(self.df, 'velocity_by_phase', float)
-        self.df = self.setcolumn(self.df, 'rssi_delta', float)
-        self.df = self.setcolumn(self.df, 'rssi_from_mean', float)
-        self.df = self.setcolumn(self.df, 'rssi_from_min', float)
-        self.df = self.setcolumn(self.df, 'doppler_channel', float)
-        self.df = self.setcolumn(self.df, 'phase_rads', float)     
-        self.df = self.setcolumn(self.df, 'doppler_by_phase', float)
-        self.df = self.setcolumn(self.df, 'velocity_by_doppler', float)
-        self.df = self.setcolumn(self.df, 'doppler_hz', float)
-        self.df = self.setcolumn(self.df, 'estimated_rssi', float)
-        self.df = self.setcolumn(self.df, 'prx_moving_parts', float)
-        self.df = self.setcolumn(self.df, 'prx_moving_parts_deoscillated', float)
-        self.df = self.setcolumn(self.df, 'estimated_prx_m_p_d', float)#ADDED by Rob 10-18-17
-        self.df = self.setcolumn(self.df, 'phase_cos_rads', float)
-        self.df = self.setcolumn(self.df, 'prx_filtered', float)
-
-        return self.df
+        return conform(df)
         
     def add_data(self, body, filterfield=None, filtervalue=None):
         self.log('add_data')
@@ -317,30 +577,87 @@ class Sensor(object):
         if not 'data' in body:
             return
 
-        if len(body['data']) == 0:
+        if nrows(body['data']) == 0:
             return
 
         body = self.augment(body)
         
         self.log('appending augmented body')        
-        self.df = self.append_data(self.df, body)
-        self.log('setting time delta index')
-        self.df['timedeltaindex'] = pd.to_timedelta(self.df['relative_timestamp'], unit='us')
-        self.log('setting index)')
-        self.df.set_index('timedeltaindex', inplace=True)
-        self.log('sorting')
-        self.df.sort_values(by='relative_timestamp', inplace=True)
-        self.log('setting last max timestamp')
-        last_max_relative_timestamp = self.max_relative_timestamp
-        self.max_relative_timestamp = self.df['relative_timestamp'].max()
-        
-        if not (filterfield is None) and not (filtervalue is None):
-            self.df.drop(self.df[self.df[filterfield] != filtervalue].index, inplace = True)        
-
-        self.df = self.set_columns(self.df)
+        start = self.append_data(body, filterfield, filtervalue)
 
-        self.df = self.fillna(self.df)
+        self.fill_from(start)
         
     # this is the method that you will override, but should include the method above
     def start(self, body, filterfield=None, filtervalue=None):
-        self.add_data(body, filterfield, filtervalue)
+        if 'chunks' in body:
+            self.add_chunks(body['chunks'], filterfield, filtervalue)
+        else:
+            self.add_data(body, filterfield, filtervalue)
+
+    # add a recording one chunk of data at a time, in order, i.e., as the simulator streams it from the server; each
+    # tag's previous read is carried from one chunk to the next, and the statistics of each channel burst are computed
+    # over the whole recording at the end, so that the result is the same as adding the recording all at once
+    def add_chunks(self, chunks, filterfield=None, filtervalue=None):
+        self.log('add_chunks')
+
+        self.streaming = True
+        self.prevrow = None
+        self.prevreads = dict()
+        self.bursts = dict()
+
+        try:
+            for data in chunks:
+                self.add_data({'data': data}, filterfield, filtervalue)
+
+            self.burst_stats()
+        finally:
+            self.streaming = False
+            self.prevrow = None
+            self.prevreads = dict()
+            self.bursts = dict()
+
+    # the key of a channel burst, with numbers as ints whether they were read as strings, ints or floats
+    def burstkey(self, epc96, antenna, channelindex):
+        def number(value):
+            try:
+                return int(float(value))
+            except (TypeError, ValueError):
+                return None # i.e., missing
+
+        return (str(epc96), number(antenna), number(channelindex))
+
+    # accumulate the estimated rssis of a channel burst in one chunk, as they were computed (before any filtering)
+    def add_burst(self, key, total, count, lowest):
+        if key in self.bursts:
+            prevtotal, prevcount, prevlowest = self.bursts[key]
+            self.bursts[key] = (prevtotal + total, prevcount + count, min(prevlowest, lowest))
+        else:
+            self.bursts[key] = (total, count, lowest)
+
+    # set rssi_from_mean and rssi_from_min of every read in the store from the mean and min of its whole channel burst,
+    # as accumulated from the chunks while streaming; the store keeps estimated_rssi as a float32, so while streaming
+    # each read also keeps what rounding took off it (estimated_rssi_residual), which is added back here so that its
+    # estimate is the float64 it was computed as, and then dropped
+    def burst_stats(self):
+        self.log('burst_stats')
+
+        if len(self.store) == 0 or not ('estimated_rssi' in self.store) or not ('estimated_rssi_residual' in self.store):
+            self.store.drop('estimated_rssi_residual')
+            return
+
+        estimated_rssi = self.store.column('estimated_rssi')
+        residual = self.store.column('estimated_rssi_residual')
+        rssi_from_mean = self.store.writable('rssi_from_mean')
+        rssi_from_min = self.store.writable('rssi_from_min')
+
+        for key, rows in self.store.groups().items():
+            key = self.burstkey(*key)
+            if not (key in self.bursts):
+                continue
+
+            total, count, lowest = self.bursts[key]
+            burst = estimated_rssi[rows].astype('float64') + residual[rows]
+            rssi_from_mean[rows] = burst - total * 1.0 / count
+            rssi_from_min[rows] = burst - lowest
+
+        self.store.drop('estimated_rssi_residual')
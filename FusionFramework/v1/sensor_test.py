@@ -19,7 +19,7 @@ class TestSensor(Sensor):
         
         print(self.df)
         
-        rows = self.df.query('relative_timestamp >= 0')
+        rows = self.window(0)
         rows = self.constantdeltat(rows, deltat=str(int(0.04 * self.timescale)) + 'U')
         
         vals = []
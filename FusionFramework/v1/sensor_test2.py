@@ -20,7 +20,7 @@ class Test2Sensor(Sensor):
         endtime = 1 * self.timescale
         
         while starttime < self.max_relative_timestamp:
-            rows = self.df.query('relative_timestamp >= ' + str(starttime) + ' and relative_timestamp < ' + str(endtime))
+            rows = self.window(starttime, endtime)
             # Do NOT resample prior to separating values like antenna/epc, because you will merge those values together even though they cross tag or antenna boundaries
         
             values = dict()
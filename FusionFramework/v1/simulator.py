@@ -1,6 +1,7 @@
 import sys
 import getopt
-import requests
+from iotclient import IoTClient
+from iotjson import decode, accept_header
 import json
 import time
 import threading
@@ -8,6 +9,7 @@ import os
 import operator
 import datetime
 import importlib 
+from rangecache import RangeCache, CachedRecording
 sys.path.insert(0, os.getcwd()) # import from current directory
 
 # Defaults:
@@ -17,9 +19,14 @@ do_debug = False
 certfile = 'NONE'
 timescale = int(1e6)
 sensor = ''
+http_timeout = 10
+http_retries = 3
+client = None
+cachedir = 'NONE'
+chunksize = 0 # seconds
 
 ############################################## OPTIONS
-def usage(server, db_password, certfile, timescale, do_debug):
+def usage(server, db_password, certfile, timescale, http_timeout, http_retries, cachedir, chunksize, do_debug):
 	print('%s [<options>] [<sensor>]' % sys.argv[0])
 	print('where <options> are:\n' \
 			'\t-h - show this help message\n' \
@@ -27,8 +34,12 @@ def usage(server, db_password, certfile, timescale, do_debug):
             '\t-p <password> - database password: default %s\n' \
             '\t-c <certfile> - path to the certificate file for verifying SSL certificate or NONE to bypass: default %s\n' \
             '\t-t <timescale> - scale of interrogator time (i.e., 1 for 1 unit per second): default %s\n' \
+            '\t-w <seconds> - seconds to wait for the server to respond to a request: default %s\n' \
+            '\t-y <retries> - number of times to retry a failed request to the server: default %s\n' \
+            '\t-e <directory> - directory in which to cache the recording, i.e., ~/.cache/iot-processing-framework, or NONE to always download it: default %s\n' \
+            '\t-k <seconds> - add the recording to the sensor in chunks of this many seconds, or 0 to add it all at once: default %s\n' \
             '\tsensor is any module and class included in the current directory, i.e., sensor_respiratoryrate.RespiratoryRateSensor\n' \
-			'\t-d - Enable debugging: default %s\n' % (server, db_password, certfile, timescale, do_debug))
+			'\t-d - Enable debugging: default %s\n' % (server, db_password, certfile, timescale, http_timeout, http_retries, cachedir, chunksize, do_debug))
 	sys.exit(1)
 
 def getopts():
@@ -38,19 +49,23 @@ def getopts():
     global timescale
     global do_debug
     global sensor
+    global http_timeout
+    global http_retries
+    global cachedir
+    global chunksize
 
 	# Check command line
-    optlist, argslist = getopt.getopt(sys.argv[1:], 'ho:p:c:t:dim:s:')
+    optlist, argslist = getopt.getopt(sys.argv[1:], 'ho:p:c:t:dim:s:w:y:e:k:')
     
     # if no processors specified, quit
     if len(argslist) == 0:
         print('Must specify one sensor.')
-        usage(server, db_password, certfile, timescale, do_debug)
+        usage(server, db_password, certfile, timescale, http_timeout, http_retries, cachedir, chunksize, do_debug)
         sys.exit(1)
     
     for opt in optlist:
         if opt[0] == '-h':
-            usage(server, db_password, certfile, timescale, do_debug)
+            usage(server, db_password, certfile, timescale, http_timeout, http_retries, cachedir, chunksize, do_debug)
         if opt[0] == '-p':
             db_password = opt[1]
         if opt[0] == '-o':
@@ -61,6 +76,14 @@ def getopts():
             timescale = int(opt[1])
         if opt[0] == '-d':
             do_debug = True
+        if opt[0] == '-w':
+            http_timeout = float(opt[1])
+        if opt[0] == '-y':
+            http_retries = int(opt[1])
+        if opt[0] == '-e':
+            cachedir = opt[1]
+        if opt[0] == '-k':
+            chunksize = float(opt[1])
             
     sensor = argslist[0]
 
@@ -75,28 +98,30 @@ def log(msg):
 
 def sendhttp(url, headerdict=dict(), bodydict=dict(), method='POST'):
     global certfile
+    global http_timeout
+    global http_retries
+    global client
 
-    if certfile == 'NONE':
-        verifypath = False
-    else:
-        verifypath = certfile
+    # all requests share one client, which keeps its connections to the server open between polls
+    if client is None:
+        client = IoTClient(certfile=certfile, timeout=http_timeout, retries=http_retries)
+
+    return client.sendhttp(url, headerdict, bodydict, method)
 
-    if method.lower() == 'get':
-        fun = requests.get
-    elif method.lower() == 'put':
-        fun = requests.put
-    elif method.lower() == 'post':
-        fun = requests.post
+def retrieve_last_n_data(n=1):
+    global db_password
+    global server
 
-    response = fun(url, verify = verifypath, data = json.dumps(bodydict), headers=headerdict)
+    resp, content = sendhttp(server + '/api/iot/stats/seconds/' + str(n), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
-    return response, response.text
+    return resp, content
 
-def retrieve_last_n_data(n=1):
+# like retrieve_data, but given in units of relative_timestamp rather than seconds
+def retrieve_range(starttime, endtime):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/stats/seconds/' + str(n), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/' + str(int(starttime)) + '/' + str(int(endtime)), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
 
@@ -105,7 +130,7 @@ def retrieve_data(start, end):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/' + str(start * timescale) + '/' + str(end * timescale), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/' + str(start * timescale) + '/' + str(end * timescale), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
 
@@ -115,6 +140,62 @@ def get_max_reltime():
     resp, content = sendhttp(server + '/api/iot/maxtime', method='GET')
 
     return resp, content
+
+# the most recent relative_timestamp on the server, or (if the server cannot be reached) the most recent one cached
+def get_max_db_time(cache):
+    global server
+    global timescale
+
+    try:
+        resp, content = get_max_reltime()
+        max_db_time = int(decode(resp, content)['data'][0]['max_relative_timestamp'])
+    except Exception as e:
+        if cache is None or cache.get_maxtime(server, timescale) is None:
+            raise
+        log('Could not reach the server (' + str(e) + '); replaying the cached recording')
+        return cache.get_maxtime(server, timescale)
+
+    if not (cache is None):
+        cache.put_maxtime(server, timescale, max_db_time)
+
+    return max_db_time
+
+# the end of the recording (exclusive), in units of relative_timestamp: the same whole seconds as retrieve_data gets
+def get_end_time(max_db_time):
+    global timescale
+
+    return int(max_db_time * 1.0 / timescale) * timescale + 1
+
+# the recording, read a minute (or without a cache, the given number of units) at a time as it is reached: from the
+# cache if that minute has been simulated before, or else downloaded and cached
+def open_recording(cache, max_db_time, chunk=None):
+    global server
+    global timescale
+
+    def fetch(starttime, endtime):
+        resp, content = retrieve_range(starttime, endtime)
+        return decode(resp, content)['data']
+
+    # cached chunks are always a minute long, so that they are the same however the recording is streamed
+    if chunk is None or not (cache is None):
+        chunk = 60 * timescale
+
+    return CachedRecording(cache, server, 0, get_end_time(max_db_time), timescale, fetch, chunk=chunk)
+
+# the data of the recording chunksize seconds at a time, read from the cache or else retrieved from the server (and
+# cached) as each chunk is needed, so that only the chunks being added are held in memory; a read at the boundary of
+# two chunks is only in the later one
+def stream_recording(cache, max_db_time):
+    global timescale
+    global chunksize
+
+    endtime = get_end_time(max_db_time)
+    chunk = max(1, int(chunksize * timescale))
+
+    recording = open_recording(cache, max_db_time, chunk)
+
+    for starttime in range(0, endtime, chunk):
+        yield recording.window(starttime, min(endtime, starttime + chunk))
     
 # Function to watch CTRL+C keyboard input
 def prog_quit(QUITFILE='quit'):
@@ -131,17 +212,25 @@ def prog_quit(QUITFILE='quit'):
 def readdata():
     global timescale
     global sensor
+    global cachedir
+    global chunksize
+
+    cache = None
+    if cachedir != 'NONE':
+        cache = RangeCache(cachedir)
 
     # find out how long the database goes
-    resp, content = get_max_reltime()
-    body = json.loads(content)
-    #print body
-    max_db_time = int(body['data'][0]['max_relative_timestamp'])
+    max_db_time = get_max_db_time(cache)
 
-    # get all data
-    resp, content = retrieve_data(0, int(max_db_time * 1.0 / timescale))
+    # get all data, from the cache if this recording has been simulated before, or a chunk at a time as the sensor adds it
+    if chunksize > 0:
+        body = {'chunks': stream_recording(cache, max_db_time)}
+    elif cache is None:
+        resp, content = retrieve_data(0, int(max_db_time * 1.0 / timescale))
 
-    body = json.loads(content)
+        body = decode(resp, content)
+    else:
+        body = {'data': open_recording(cache, max_db_time).window()}
     
     # for the sensor, determine what it is, pass it all the data and launch
     ptclass = getattr(importlib.import_module(sensor.split(".")[0]), sensor.split(".")[1])
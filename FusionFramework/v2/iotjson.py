@@ -0,0 +1,222 @@
+import json
+import numpy as np
+
+# orjson parses several times faster than the json module when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# msgpack is needed for the columnar binary format; without it, responses are requested as JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPE = 'application/x-msgpack'
+JSON_TYPE = 'application/json'
+
+# fields whose values are identifiers rather than numbers, even if they happen to look like numbers
+TEXT_FIELDS = ('epc96', 'freeform')
+
+# the Accept header for requests for tag reads: the columnar binary format if it can be decoded here, otherwise JSON
+def accept_header():
+    if msgpack is None:
+        return JSON_TYPE
+    else:
+        return MSGPACK_TYPE + ', ' + JSON_TYPE + ';q=0.5'
+
+# parse a response from the IoT Sensor Framework server
+def loads(content):
+    if not (orjson is None):
+        return orjson.loads(content)
+    else:
+        return json.loads(content)
+
+# parse a response in whichever format the server chose to send it; a binary response's data is a dict of columns
+def decode(resp, content):
+    if resp.headers.get('Content-Type', '').split(';')[0].strip() == MSGPACK_TYPE:
+        return unpack(content)
+    else:
+        return loads(content)
+
+# The columnar binary format is a MessagePack map of the body, in which data is a map of
+# {'length': number of rows, 'columns': {name: column}}.  Numeric columns are {'dtype': numpy type string, 'values': raw
+# little-endian bytes}, and other columns are arrays of values.
+def pack(body):
+    data = body['data']
+    if not is_columns(data):
+        data = columns_of(data, expand=False)
+
+    columns = dict()
+    for col in data:
+        values = np.asarray(data[col])
+        if values.dtype.kind in 'iuf':
+            values = values.astype(values.dtype.newbyteorder('<'))
+            columns[col] = {'dtype': values.dtype.str, 'values': values.tobytes()}
+        else:
+            columns[col] = values.tolist()
+
+    packed = dict(body)
+    packed['data'] = {'length': nrows(data), 'columns': columns}
+
+    return msgpack.packb(packed, use_bin_type=True)
+
+def unpack(content):
+    body = msgpack.unpackb(content, raw=False)
+
+    columns = dict()
+    for col, values in body['data']['columns'].items():
+        if isinstance(values, dict):
+            columns[col] = np.frombuffer(values['values'], dtype=np.dtype(values['dtype']))
+        else:
+            columns[col] = np.empty(len(values), dtype=object)
+            columns[col][:] = values
+
+    body['data'] = columns
+
+    return body
+
+# the freeform field may be JSON encoded more than once, so decode until we reach the dictionary; its values keep their JSON types
+def unwrap(freeform):
+    while not (type(freeform) is dict):
+        freeform = loads(freeform)
+
+    return freeform
+
+# merge the freeform fields of each row into the row itself, in place, keeping the types of their values
+def flatten_rows(rows):
+    for row in rows:
+        if 'freeform' in row:
+            row.update(unwrap(row['freeform']))
+
+    return rows
+
+# Tag reads arrive either as a list of row dicts (from JSON) or as a dict of columns (from the binary format);
+# these functions accept either.
+
+def is_columns(data):
+    return isinstance(data, dict)
+
+def nrows(data):
+    if is_columns(data):
+        for col in data:
+            return len(data[col])
+        return 0
+    else:
+        return len(data)
+
+# the values of one field, in row order, or Nones if no row has it
+def column(data, col):
+    if is_columns(data):
+        if col in data:
+            return data[col]
+        else:
+            return [None] * nrows(data)
+    else:
+        return [row.get(col) for row in data]
+
+def to_rows(data):
+    if is_columns(data):
+        cols = list(data.keys())
+        values = [np.asarray(data[col]).tolist() for col in cols]
+        return [dict(zip(cols, rowvalues)) for rowvalues in zip(*values)]
+    else:
+        return data
+
+# the rows for which mask is true
+def take(data, mask):
+    mask = np.asarray(mask, dtype=bool)
+
+    if is_columns(data):
+        return dict((col, np.asarray(data[col])[mask]) for col in data)
+    else:
+        return [row for row, keep in zip(data, mask) if keep]
+
+# a copy of the rows that can be changed without changing data, i.e., one for each of several readers
+def copy_of(data):
+    if is_columns(data):
+        return dict((col, np.array(data[col], copy=True)) for col in data)
+    else:
+        return [dict(row) for row in data]
+
+# the rows of each of parts in turn; the result is a list of rows unless one of the parts is columns
+def concat(parts):
+    parts = [part for part in parts if nrows(part) > 0]
+
+    if len(parts) == 0:
+        return []
+    elif all(not is_columns(part) for part in parts):
+        rows = []
+        for part in parts:
+            rows.extend(part)
+        return rows
+    else:
+        parts = [part if is_columns(part) else columns_of(part, expand=False) for part in parts]
+
+        cols = []
+        for part in parts:
+            for col in part:
+                if not (col in cols):
+                    cols.append(col)
+
+        def values(part, col):
+            if col in part:
+                return np.asarray(part[col])
+            else:
+                return np.full(nrows(part), None, dtype=object)
+
+        return dict((col, np.concatenate([values(part, col) for part in parts])) for col in cols)
+
+# decode tag reads, along with their freeform fields, into a dict of columns in a single pass: columns of
+# numbers (or of numbers sent as strings) become float arrays, or integer arrays if they are whole and complete, and
+# the rest become object arrays; rows without a value in a column have NaN (or None) there
+def decode_columns(data):
+    if is_columns(data):
+        columns = dict(data)
+
+        if 'freeform' in columns:
+            columns.update(columns_of([unwrap(f) for f in columns['freeform']], expand=False))
+
+        return columns
+    else:
+        return columns_of(data, expand=True)
+
+def columns_of(rows, expand=True):
+    values = dict()
+
+    for i, row in enumerate(rows):
+        if expand and 'freeform' in row:
+            fields = dict(row)
+            fields.update(unwrap(row['freeform']))
+        else:
+            fields = row
+
+        for col in fields:
+            if not (col in values):
+                values[col] = [None] * i
+            values[col].append(fields[col])
+
+        for col in values:
+            if len(values[col]) <= i:
+                values[col].append(None)
+
+    return dict((col, typed_column(col, values[col])) for col in values)
+
+def typed_column(col, values):
+    if not (col in TEXT_FIELDS):
+        kinds = set(type(v) for v in values)
+
+        if kinds <= set([int]) and all(-2**63 <= v < 2**63 for v in values):
+            return np.array(values, dtype='int64')
+        elif kinds <= set([int, float, type(None)]):
+            return np.array([np.nan if v is None else v for v in values], dtype='float64')
+        elif kinds <= set([int, float, str, type(None)]):
+            try:
+                return np.array([np.nan if v is None else v for v in values], dtype='float64')
+            except ValueError:
+                pass
+
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
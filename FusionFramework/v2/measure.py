@@ -71,14 +71,14 @@ class Measure(object):
         
         # capture the first epc96 tag seen so that we only process those; must be done before we do constant delta t or any resampling, because this removes the string values from the query... set epctag prior to this point to override with a specific tag
         if epctag is None:
-            rows = sensor.df.query('relative_timestamp >= ' + str(iteration * timescale * iterationsize - gobacksec * timescale) + ' and relative_timestamp < ' + str(iteration * timescale * iterationsize))
+            rows = sensor.window(iteration * timescale * iterationsize - gobacksec * timescale, iteration * timescale * iterationsize)
             
             if len(rows) <= 0:
                 return nontrivialmagnitude
             
             epctag = rows['epc96'][0]
         
-        rows = sensor.df.query('relative_timestamp >= ' + str(iteration * timescale * iterationsize - gobacksec * timescale) + ' and relative_timestamp < ' + str(iteration * timescale * iterationsize) + ' and epc96 == \"' + epctag + '\"')
+        rows = sensor.window(iteration * timescale * iterationsize - gobacksec * timescale, iteration * timescale * iterationsize, epc=epctag)
     
         if len(rows) <= 0:
             return nontrivialmagnitude
@@ -24,7 +24,12 @@ def doppler_by_channel(doppler, ch):
 
 def phase_to_rads(phase):
     return phase * 2.0 * math.pi / 4096
-    
+
+# array version of freqbychannel for columnar computations
+def freqsbychannel(channels):
+    channels = np.asarray(channels)
+    return np.where((channels < 1) | (channels > 50), -1, 1e6 * (902.75 + 0.5 * (channels-1)))
+
 # https://gist.github.com/endolith/250860
 def peakdet(v, delta, x = None):
     from numpy import NaN, Inf, arange, isscalar, asarray, array
@@ -1,4 +1,5 @@
 from sensor import *
+from iotjson import to_rows
 import pandas as pd
 import time
 import operator
@@ -39,8 +40,12 @@ class FusionSensor(Sensor):
         self.perturber = None #RandomPerturber()
         
     def start(self, body):
+        # perturbers change a list of row dicts, so data that arrived as columns (i.e., from the cache) is given to them as rows
         if not (self.perturber is None):
-            body = self.perturber.perturb(body)
+            if 'chunks' in body:
+                body = {'chunks': (self.perturber.perturb({'data': to_rows(data)})['data'] for data in body['chunks'])}
+            else:
+                body = self.perturber.perturb({'data': to_rows(body['data'])})
         #print 'len', len(body['data'])
             
         super(FusionSensor, self).start(body)
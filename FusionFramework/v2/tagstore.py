@@ -0,0 +1,623 @@
+import numpy as np
+import pandas as pd
+
+# Fill missing values with the nearest valid value in the same column (the earlier one if they are equally near),
+# as long as it is no more than maxcount rows away.  This is what alternately padding and back filling one row at
+# a time, maxcount times, produces, but computed in a single pass from the distance to the nearest valid values.
+def fillnearest(values, maxcount=10000):
+    values = np.asarray(values)
+    missing = pd.isnull(values)
+
+    if not missing.any() or missing.all():
+        return values
+
+    n = len(values)
+    positions = np.arange(n)
+    before = np.maximum.accumulate(np.where(missing, -1, positions)) # nearest valid position at or before each row, or -1
+    after = np.minimum.accumulate(np.where(missing, n, positions)[::-1])[::-1] # nearest valid position at or after each row, or n
+
+    toofar = maxcount + 1
+    dbefore = np.where(before >= 0, positions - before, toofar)
+    dafter = np.where(after < n, after - positions, toofar)
+
+    usebefore = missing & (dbefore <= dafter) & (dbefore <= maxcount)
+    useafter = missing & (dafter < dbefore) & (dafter <= maxcount)
+
+    values = values.copy()
+    values[usebefore] = values[before[usebefore]]
+    values[useafter] = values[after[useafter]]
+
+    return values
+
+# The declared type of each column of tag reads, raw and derived, which conform applies to each batch before it is
+# stored: timestamps are 64-bit integers, antennas and channels 16-bit integers, tags strings (stored as categorical
+# codes), and measurements 32-bit floats, whose seven significant digits are more than the reader reports.
+SCHEMA = {
+    'relative_timestamp': 'int64',
+    'epc96': 'str',
+    'antenna': 'int16',
+    'channelindex': 'int16',
+    'rssi': 'float32',
+    'phase': 'float32',
+    'doppler': 'float32',
+    'doppler_hz': 'float32',
+    'doppler_channel': 'float32',
+    'doppler_by_phase': 'float32',
+    'velocity_by_doppler': 'float32',
+    'velocity_by_phase': 'float32',
+    'phase_rads': 'float32',
+    'phase_cos_rads': 'float32',
+    'rssi_delta': 'float32',
+    'rssi_from_mean': 'float32',
+    'rssi_from_min': 'float32',
+    'estimated_rssi': 'float32',
+    'prx_moving_parts': 'float32',
+    'prx_moving_parts_deoscillated': 'float32',
+    'estimated_prx_m_p_d': 'float32',
+    'prx_filtered': 'float32',
+}
+
+# cast the columns of a batch to their types in the schema with a single astype, adding any column (other than the
+# timestamp) that the batch lacks as missing values; integer columns with missing or fractional values are left as
+# floats, since an integer cannot be missing
+def conform(df, schema=SCHEMA, sortfield='relative_timestamp'):
+    missing = dict((col, np.nan) for col in schema if not (col in df.columns) and col != sortfield)
+    if len(missing) > 0:
+        df = df.assign(**missing)
+
+    types = dict()
+    for col in schema:
+        if col in df.columns:
+            dtype = schema[col]
+            if dtype == 'str':
+                dtype = str
+            elif np.dtype(dtype).kind == 'i' and col != sortfield and not smallints(df[col].values, np.dtype(dtype)):
+                dtype = 'float32'
+            types[col] = dtype
+
+    return df.astype(types)
+
+# An index of the rows of each group of tag reads (i.e., each epc96, antenna, and channelindex) in a TagStore: the
+# positions of each group's rows, in order.  Positions are counted from the first row ever stored rather than from the
+# first row still stored, so that evicting rows from the front does not move the rest.  Adding rows at the end only
+# extends the positions of their groups, and replacing rows from some position onwards (i.e., when an out of order
+# batch is merged) first truncates every group's positions there, which is a binary search per group.  Evicting rows
+# from the front of the store trims the positions before them from each group in the same way, by advancing the group's
+# head; the space they took is reclaimed when the group's array is next reallocated, and groups left without any
+# positions (i.e., tags that have not been read within the retention window) are dropped.
+class GroupIndex(object):
+    def __init__(self, fields=('epc96', 'antenna', 'channelindex')):
+        self.fields = fields
+        self.positions = dict() # group key (a tuple of the fields' values) -> array of positions, with room to grow
+        self.heads = dict() # group key -> index of the first position in use
+        self.counts = dict() # group key -> index just past the last position in use
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def clear(self):
+        self.positions = dict()
+        self.heads = dict()
+        self.counts = dict()
+
+    # forget the positions from start onwards
+    def truncate(self, start):
+        for key in self.positions:
+            head = self.heads[key]
+            self.counts[key] = head + int(np.searchsorted(self.positions[key][head:self.counts[key]], start, side='left'))
+
+    # forget the positions before start, dropping any group that has none left
+    def trim(self, start):
+        for key in list(self.positions):
+            head = self.heads[key]
+            head = head + int(np.searchsorted(self.positions[key][head:self.counts[key]], start, side='left'))
+
+            if head >= self.counts[key]:
+                del self.positions[key]
+                del self.heads[key]
+                del self.counts[key]
+            else:
+                self.heads[key] = head
+
+    # index n rows, the first of which is at position start, given a dict of their values of each field
+    def add(self, start, columns, n):
+        if n == 0:
+            return
+
+        fields = dict((field, columns[field] if field in columns else np.full(n, None, dtype=object)) for field in self.fields)
+        groups = pd.DataFrame(fields).groupby(list(self.fields), sort=False, dropna=False).indices
+
+        for key, rows in groups.items():
+            if not (key in self.positions):
+                self.positions[key] = np.empty(max(16, len(rows)), dtype='int64')
+                self.heads[key] = 0
+                self.counts[key] = 0
+
+            # the positions in use are moved to the front of a new array, leaving as much room again as they take
+            n = self.counts[key]
+            if n + len(rows) > len(self.positions[key]):
+                head = self.heads[key]
+                arr = np.empty(max(16, 2 * (n - head + len(rows))), dtype='int64')
+                arr[:n - head] = self.positions[key][head:n]
+                self.positions[key] = arr
+                self.heads[key] = 0
+                n = n - head
+
+            self.positions[key][n:n + len(rows)] = start + rows
+            self.counts[key] = n + len(rows)
+
+    # the positions of a group's rows in [lo, hi)
+    def rows(self, key, lo, hi):
+        positions = self.positions[key][self.heads[key]:self.counts[key]]
+
+        return positions[np.searchsorted(positions, lo, side='left'):np.searchsorted(positions, hi, side='left')]
+
+# The distinct values of a categorical column (i.e., epc96), each kept once: the store holds the integer code of each
+# row's value, which is its position in values, or -1 if the row has no value.  Codes are never reused, so they stay
+# valid as rows are evicted.
+class Categories(object):
+    def __init__(self):
+        self.values = []
+        self.codes = dict() # value -> code
+        self.dtype = None # the values as a pandas CategoricalDtype, built when a frame needs them
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        if not (value in self.codes):
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+            self.dtype = None
+
+        return self.codes[value]
+
+    # the codes of an array of values, adding any values not seen before; only the distinct values are looked up
+    def encode(self, values):
+        codes, uniques = pd.factorize(values)
+
+        table = np.empty(len(uniques) + 1, dtype='int64')
+        for i, value in enumerate(uniques):
+            table[i] = self.code(value)
+        table[-1] = -1 # factorize gives missing values a code of -1
+
+        return table[codes]
+
+    # the smallest integer type that holds every code, which is the type in which pandas keeps the codes of a
+    # Categorical, so that a Categorical can be made from the store's codes without copying them
+    def codetype(self):
+        for dtype in ('int8', 'int16', 'int32'):
+            if len(self.values) < np.iinfo(dtype).max:
+                return np.dtype(dtype)
+
+        return np.dtype('int64')
+
+    # a Categorical of the values whose codes are given; it shares the codes rather than copying them
+    def decode(self, codes):
+        if self.dtype is None:
+            self.dtype = pd.CategoricalDtype(pd.Index(self.values, dtype=object))
+
+        try:
+            return pd.Categorical.from_codes(codes, dtype=self.dtype, validate=False)
+        except TypeError: # pandas < 2.1
+            return pd.Categorical.from_codes(codes, dtype=self.dtype)
+
+# whether values are whole numbers that fit in a small integer column (i.e., an antenna or channelindex)
+def smallints(values, dtype=np.dtype('int16')):
+    values = np.asarray(values)
+
+    if values.dtype.kind in 'iub':
+        return len(values) == 0 or (values.min() >= np.iinfo(dtype).min and values.max() <= np.iinfo(dtype).max)
+    elif values.dtype.kind == 'f':
+        return bool(np.all(np.isfinite(values)) and np.all(np.mod(values, 1) == 0)) and smallints(values.astype('int64'), dtype)
+    else:
+        return False
+
+# An append-optimized column store for tag reads, kept sorted by the sort field (relative_timestamp).
+# Each column is a preallocated numpy array whose capacity doubles as needed, so that appending a batch
+# costs time in proportion to the batch rather than to the whole history: a batch that arrives in order
+# is copied onto the end, and a batch that overlaps the end of the history is only merged with the rows
+# that it overlaps.
+#
+# The store can also be bounded to the most recent maxspan units of the sort field and/or the most recent
+# maxrows rows.  Older rows are evicted from the front of the buffer by advancing its head, and the space
+# they occupied is reclaimed the next time the buffer fills, so memory stays flat once the window is full.
+#
+# The rows of each epc96, antenna, and channelindex are indexed as they are added (see GroupIndex), so that the rows
+# of one tag, or statistics over each group, do not need a scan of the whole store.
+#
+# Frames are handed out as views of the columns rather than copies, so rows that a frame may show are never written
+# in place: a column is copied before any of them are overwritten (i.e., when a batch is merged with the rows that it
+# overlaps, or missing values are filled in the history), and the frames already handed out keep the old copy.
+#
+# Tag identifiers repeat on every row, so the categorical columns (epc96) are stored as integer codes into a
+# dictionary of their distinct values, and handed out in frames as Categoricals; and the smallint columns (antenna and
+# channelindex) are stored as 16-bit integers for as long as their values are whole numbers.  The group index is
+# built over the codes and integers, so grouping and selecting rows compares integers rather than strings.
+class TagStore(object):
+    def __init__(self, capacity=4096, sortfield='relative_timestamp', maxspan=None, maxrows=None, categorical=('epc96',), smallints=('antenna', 'channelindex'), schema=SCHEMA):
+        self.capacity = capacity
+        self.sortfield = sortfield
+        self.maxspan = maxspan
+        self.maxrows = maxrows
+        self.columns = dict() # column name -> numpy array of length capacity; rows [head, head + size) are valid
+        self.head = 0
+        self.size = 0
+        self.version = 0 # incremented on every change, so that cached frames can be rebuilt
+        self.cachedframe = None
+        self.cachedversion = -1
+        self.readonly = False # whether frames are read-only views, i.e., when the store is shared by several readers
+        self.shared = 0 # the end of the buffer positions that frames handed out may show, which are copied before they are written
+        self.owned = set() # the columns copied since the last frame was handed out, which no frame shows
+        self.index = GroupIndex()
+        self.evicted = 0 # number of rows ever evicted, which is the index position of the first valid row
+        self.categorical = categorical
+        self.smallints = smallints
+        self.categories = dict((col, Categories()) for col in categorical)
+        self.schema = schema
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, col):
+        return col in self.columns
+
+    # the storage type of each column: the sort field is an integer, categorical columns are codes, smallint columns
+    # are 16-bit integers if their values are whole numbers, other numbers are floats (of the width in the schema, or
+    # 32 bits for smallint columns that have been widened), and everything else is an object
+    def storagetype(self, col, values):
+        if col == self.sortfield:
+            return np.dtype('int64')
+        elif col in self.categories:
+            return self.categories[col].codetype()
+        elif col in self.smallints and smallints(values):
+            return np.dtype('int16')
+        elif values.dtype.kind in 'fiub':
+            return self.floattype(col)
+        else:
+            return np.dtype(object)
+
+    # an array of n missing values of a column: a code of -1 for categorical columns, 0 for integers (which have no
+    # missing value, and so are widened to floats before a missing value is stored in them), and NaN otherwise
+    def empty(self, dtype, n, col=None):
+        if col in self.categories:
+            return np.full(n, -1, dtype=dtype)
+        elif dtype.kind == 'i':
+            return np.zeros(n, dtype=dtype)
+        else:
+            return np.full(n, np.nan, dtype=dtype)
+
+    def floattype(self, col):
+        if col in self.smallints or (col in self.schema and self.schema[col] == 'float32'):
+            return np.dtype('float32')
+        else:
+            return np.dtype('float64')
+
+    # which of the values of a column are missing
+    def isnull(self, col, values):
+        if col in self.categories:
+            return values < 0
+        else:
+            return pd.isnull(values)
+
+    # replace a column with a copy of a wider type, i.e., when its values no longer fit
+    def widen(self, col, dtype):
+        self.columns[col] = self.columns[col].astype(dtype)
+        self.owned.add(col)
+
+        return self.columns[col]
+
+    # make room for rows [0, needed), moving the valid rows to the front of new arrays if the buffer is full; new
+    # arrays are allocated rather than moving rows in place, so that frames already handed out remain intact
+    def grow(self, needed):
+        if self.head + needed <= self.capacity:
+            return
+
+        # leave as much room again as is needed, so that the cost of copying is amortized over the rows to come
+        capacity = self.capacity
+        while capacity < 2 * needed:
+            capacity = capacity * 2
+
+        for col in self.columns:
+            arr = self.empty(self.columns[col].dtype, capacity, col)
+            arr[:self.size] = self.columns[col][self.head:self.head + self.size]
+            self.columns[col] = arr
+            self.owned.add(col)
+
+        self.capacity = capacity
+        self.head = 0
+        self.shared = 0
+
+    # the array of a column, copied first if rows from start onwards are about to be written and a frame may show them
+    def own(self, col, start):
+        if self.head + start < self.shared and not (col in self.owned):
+            self.columns[col] = self.columns[col].copy()
+            self.owned.add(col)
+
+        return self.columns[col]
+
+    # view of the valid rows of a column to write through, i.e., to update values computed over the whole store
+    def writable(self, col):
+        self.own(col, 0)
+        self.version = self.version + 1
+
+        return self.column(col)
+
+    # write values into rows [start, start + len(values)) of col, widening the column to objects if the values are not
+    # numeric (or to floats if a smallint column's values are not whole numbers)
+    def put(self, col, start, values):
+        if col in self.categories:
+            values = self.categories[col].encode(values)
+        else:
+            values = np.asarray(values)
+
+        if not (col in self.columns):
+            self.columns[col] = self.empty(self.storagetype(col, values), self.capacity, col)
+            self.owned.add(col)
+
+        start = self.head + start
+
+        arr = self.columns[col]
+        if col in self.categories:
+            if arr.dtype != self.categories[col].codetype():
+                arr = self.widen(col, self.categories[col].codetype())
+        elif arr.dtype.kind == 'i' and col != self.sortfield and not smallints(values, arr.dtype):
+            arr = self.widen(col, self.floattype(col))
+
+        if arr.dtype.kind != 'O' and values.dtype.kind not in 'fiub':
+            try:
+                values = values.astype(arr.dtype)
+            except (TypeError, ValueError):
+                arr = arr.astype(object)
+                self.columns[col] = arr
+                self.owned.add(col)
+
+        arr[start:start + len(values)] = values
+
+    # replace rows [start, size) with the rows of df
+    def splice(self, start, df):
+        n = len(df)
+        end = start + n
+
+        self.grow(end)
+
+        for col in self.columns:
+            self.own(col, start)
+
+        for col in df.columns:
+            self.put(col, start, df[col].values)
+
+        for col in self.columns:
+            if not (col in df.columns):
+                if self.columns[col].dtype.kind == 'i' and col != self.sortfield and not (col in self.categories):
+                    self.widen(col, self.floattype(col))
+                self.columns[col][self.head + start:self.head + end] = self.empty(self.columns[col].dtype, 1, col)[0]
+
+            # clear any rows left over from before so that their values don't reappear when the rows are reused
+            if end < self.size:
+                self.columns[col][self.head + end:self.head + self.size] = self.empty(self.columns[col].dtype, 1, col)[0]
+
+        self.size = end
+        self.version = self.version + 1
+
+        self.index.truncate(self.evicted + start)
+        self.index.add(self.evicted + start, dict((field, self.column(field)[start:end]) for field in self.index.fields if field in self.columns), n)
+
+    # add a batch of rows, returning the position of the first row that changed (after any eviction)
+    def append(self, df):
+        if len(df) == 0:
+            return self.size
+
+        # the sort field may arrive as strings (i.e., rows decoded from JSON), which would neither sort nor compare as numbers
+        if df[self.sortfield].dtype.kind != 'i':
+            df = df.astype({self.sortfield: 'int64'})
+
+        df = df.sort_values(by=self.sortfield, kind='mergesort')
+        first = df[self.sortfield].iloc[0]
+
+        if self.size == 0 or first >= self.max():
+            start = self.size
+        else:
+            # only the rows at or after the first new timestamp need to be merged with the batch
+            start = int(np.searchsorted(self.column(self.sortfield), first, side='right'))
+            df = pd.concat([self.tail(start), df.reset_index(drop=True)], ignore_index=True)
+            df = df.sort_values(by=self.sortfield, kind='mergesort')
+
+        self.splice(start, df)
+
+        return max(0, start - self.evict())
+
+    # drop the oldest rows beyond the retention window, returning how many were dropped
+    def evict(self):
+        n = 0
+
+        if not (self.maxspan is None) and self.size > 0:
+            n = int(np.searchsorted(self.column(self.sortfield), self.max() - self.maxspan, side='left'))
+
+        if not (self.maxrows is None) and self.size - n > self.maxrows:
+            n = self.size - self.maxrows
+
+        if n > 0:
+            # the evicted rows are left untouched until the buffer is reallocated, since frames already handed out may still refer to them
+            self.head = self.head + n
+            self.size = self.size - n
+            self.evicted = self.evicted + n
+            self.version = self.version + 1
+
+            self.index.trim(self.evicted)
+
+        return n
+
+    # fill missing values in rows [start, size) as fillnearest would over the whole store: the row before start is used
+    # to pad from, and a column's first values are also back filled into the history before start
+    def fill(self, start, maxcount=10000):
+        reindex = None # the first row whose group fields may have been filled
+
+        for col in list(self.columns):
+            arr = self.column(col)
+            missing = self.isnull(col, arr[start:])
+
+            if start > 0 and self.isnull(col, arr[start - 1]):
+                # nothing before start could be filled, so this column has no values within maxcount rows of start
+                if missing.all():
+                    continue
+                lo = max(0, start - 1 - maxcount)
+            elif missing.any():
+                lo = max(0, start - 1)
+            else:
+                continue
+
+            if col in self.categories:
+                codes = arr[lo:].astype('float64')
+                codes[codes < 0] = np.nan
+                codes = fillnearest(codes, maxcount)
+                filled = np.where(np.isnan(codes), -1, codes)
+            else:
+                filled = fillnearest(arr[lo:], maxcount)
+
+            # only rows from start onwards change unless the history was back filled, in which case it is copied first
+            first = lo
+            if lo == start - 1:
+                first = start
+
+            self.own(col, first)[self.head + first:self.head + self.size] = filled[first - lo:]
+            self.version = self.version + 1
+
+            if col in self.index.fields and (reindex is None or lo < reindex):
+                reindex = lo
+
+        # rows whose tag, antenna, or channel was missing now belong to another group
+        if not (reindex is None):
+            self.index.truncate(self.evicted + reindex)
+            self.index.add(self.evicted + reindex, dict((field, self.column(field)[reindex:]) for field in self.index.fields if field in self.columns), self.size - reindex)
+
+    # drop rows from start onwards that duplicate another row, keeping the first
+    def dedupe(self, start):
+        if start >= self.size:
+            return
+
+        # duplicates have the same timestamp, so only rows sharing a timestamp with the rows from start onwards need comparing
+        lo = int(np.searchsorted(self.column(self.sortfield), self.column(self.sortfield)[start], side='left'))
+
+        df = self.tail(lo)
+        duplicated = df.duplicated().values
+
+        if duplicated.any():
+            self.splice(lo, df[~duplicated])
+
+    # positions [lo, hi) of the rows with start <= sort field < end, found by binary search; None leaves that end open
+    def bounds(self, start=None, end=None):
+        lo = 0
+        if not (start is None):
+            lo = int(np.searchsorted(self.column(self.sortfield), start, side='left'))
+
+        hi = self.size
+        if not (end is None):
+            hi = max(lo, int(np.searchsorted(self.column(self.sortfield), end, side='left')))
+
+        return lo, hi
+
+    # the positions of the rows of each group within rows [lo, hi), as a dict of group key -> positions in order; the
+    # keys are the stored values, i.e., codes for categorical fields, unless decoded
+    def groups(self, lo=0, hi=None, decoded=True):
+        if hi is None:
+            hi = self.size
+
+        groups = dict()
+        for key in self.index:
+            rows = self.index.rows(key, self.evicted + lo, self.evicted + hi)
+            if len(rows) > 0:
+                if decoded:
+                    key = tuple(self.decodevalue(field, value) for field, value in zip(self.index.fields, key))
+                groups[key] = rows - self.evicted
+
+        return groups
+
+    def decodevalue(self, col, value):
+        if col in self.categories:
+            if value < 0:
+                return None
+            return self.categories[col].values[value]
+        else:
+            return value
+
+    # the positions, in order, of the rows within [lo, hi) whose group fields have the given values, i.e., epc96='...'
+    def select(self, lo=0, hi=None, **values):
+        fields = self.index.fields
+        for field in values:
+            if not (field in fields):
+                raise KeyError('Rows can only be selected by ' + ', '.join(fields) + ', not ' + str(field))
+
+        # compare the codes of categorical fields rather than their values
+        for field in values:
+            if field in self.categories:
+                if not (values[field] in self.categories[field].codes):
+                    return np.empty(0, dtype='int64')
+                values[field] = self.categories[field].codes[values[field]]
+
+        matches = [rows for key, rows in self.groups(lo, hi, decoded=False).items() if all(key[fields.index(field)] == values[field] for field in values)]
+
+        if len(matches) == 0:
+            return np.empty(0, dtype='int64')
+
+        return np.sort(np.concatenate(matches), kind='mergesort')
+
+    # view of the valid rows of a column
+    def column(self, col):
+        return self.columns[col][self.head:self.head + self.size]
+
+    # view of the valid rows of a column as handed out in frames, which cannot be written through if the store is read-only
+    def view(self, col):
+        arr = self.column(col).view()
+        if self.readonly:
+            arr.flags.writeable = False
+        return arr
+
+    # the values of a column given its stored values: a Categorical of a categorical column's codes, which shares them
+    def decode(self, col, arr):
+        if col in self.categories:
+            return self.categories[col].decode(arr)
+        else:
+            return arr
+
+    # copy of rows [start, size) as a DataFrame
+    def tail(self, start):
+        return pd.DataFrame(dict((col, self.decode(col, self.column(col)[start:].copy())) for col in self.columns))
+
+    def max(self):
+        return self.columns[self.sortfield][self.head + self.size - 1]
+
+    # remove a column, i.e., one that was only needed while the store was being built
+    def drop(self, col):
+        if col in self.columns:
+            del self.columns[col]
+            self.owned.discard(col)
+            self.version = self.version + 1
+
+    # replace the entire contents of the store
+    def reset(self, df):
+        self.columns = dict()
+        self.head = 0
+        self.size = 0
+        self.index.clear()
+        self.evicted = 0
+        self.shared = 0
+        self.categories = dict((col, Categories()) for col in self.categorical)
+        self.splice(0, df.reset_index(drop=True))
+
+    # a DataFrame indexed by a timedelta of the sort field; its columns are views of the store rather than
+    # copies, and rows that it shows are copied before they are overwritten, so it does not change once handed out
+    def frame(self):
+        if self.cachedversion != self.version:
+            if self.size == 0:
+                self.cachedframe = pd.DataFrame(dtype='float')
+            else:
+                data = dict((col, self.decode(col, self.view(col))) for col in self.columns)
+                index = pd.Index(self.column(self.sortfield).view('timedelta64[us]'), name='timedeltaindex')
+                self.cachedframe = pd.DataFrame(data, index=index, copy=False)
+
+            self.cachedversion = self.version
+            self.shared = self.head + self.size
+            self.owned = set()
+
+        return self.cachedframe
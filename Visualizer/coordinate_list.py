@@ -1,3 +1,5 @@
+import numpy as np
+
 # array of strings to pass to plt.plot to plot each respective plot: color and dot type
 # parallel arrays, these must have the same size
 # plot markers: http://matplotlib.org/api/markers_api.html
@@ -5,10 +7,61 @@
 CL_plotcolors = ['b', 'r', 'g', 'c', 'm', 'y', 'k', 'b', 'r', 'b', 'c', 'm']
 CL_plotdots   = ['o', 's', '^', 'v', '<', '>', '8', 'p', '*', 'h', '+', 'D'] 
 
+# The x and y values plotted for one signature, as the rows of a preallocated numpy buffer.  Only the points within span of the
+# newest x value are kept (all of them if span is None): older points are dropped from the front as new ones are
+# appended, and when the buffer fills up, the points kept are moved back to its start (or into a buffer twice the
+# size if they fill more than half of it).  The points kept are always contiguous, so xvals and yvals (and points,
+# the (x, y) rows that a LineCollection takes as a segment) are views of the buffer that can be plotted without copying them.
 class CoordinateList:
-	def __init__(self, _epc96, _index):
+	__slots__ = ('epc96', 'coord_index', 'span', 'buf', 'start', 'end')
+
+	def __init__(self, _epc96, _index, span=None, capacity=1024):
 		self.epc96 = _epc96
 		self.coord_index = int(_index)
+		self.span = span
+
+		self.buf = np.empty((max(1, capacity), 2), dtype='float64')
+		self.start = 0 # the points kept are buf[start:end]
+		self.end = 0
+
+	def __len__(self):
+		return self.end - self.start
+
+	@property
+	def points(self):
+		return self.buf[self.start:self.end]
+
+	@property
+	def xvals(self):
+		return self.buf[self.start:self.end, 0]
+
+	@property
+	def yvals(self):
+		return self.buf[self.start:self.end, 1]
+
+	def append(self, x, y):
+		if self.end == len(self.buf):
+			self.make_room()
+
+		self.buf[self.end, 0] = x
+		self.buf[self.end, 1] = y
+		self.end = self.end + 1
+
+		if not (self.span is None):
+			while self.buf[self.start, 0] < self.buf[self.end - 1, 0] - self.span:
+				self.start = self.start + 1
+
+	def make_room(self):
+		n = self.end - self.start
+
+		if 2 * n > len(self.buf):
+			buf = np.empty((2 * len(self.buf), 2), dtype='float64')
+		else:
+			buf = self.buf
+
+		# the ranges may overlap when moving within the same buffer, which numpy copies correctly
+		buf[:n] = self.buf[self.start:self.end]
 
-		self.xvals = []
-		self.yvals = []
+		self.buf = buf
+		self.start = 0
+		self.end = n
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Decimation of a line for display: a plot cannot show more than a few points in each column of pixels, so of the
+# points that fall in each column only the first, last, lowest and highest are kept, in their original order.  The
+# line drawn through them covers the same pixels as the line through every point, so peaks are never lost, but the
+# number of points drawn is at most four times the width of the plot no matter how many there are.
+
+# the indices of the points of x (sorted ascending) and y to draw on a plot width pixels wide showing xmin to xmax;
+# points outside of that range are each given a column beyond the edge, so that the line still runs off the plot;
+# every point is kept if there are too few to be worth decimating.  A NaN in y breaks the line where it is, so the
+# first NaN in each column is kept as well, and the line has the same gaps as the line through every point.
+def minmax_indices(x, y, xmin, xmax, width):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    width = int(width)
+
+    if len(y) <= 4 * width or width < 1 or not (xmax > xmin):
+        return np.arange(len(y))
+
+    column = np.floor((x - xmin) * width / (xmax - xmin))
+    column = np.clip(column, -1, width)
+
+    # the points are sorted by x, so each column's points are together
+    starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+    ends = np.r_[starts[1:], len(y)]
+    segment = np.repeat(np.arange(len(starts)), ends - starts)
+
+    # fmin and fmax skip NaNs, and no point matches the NaN of a column with nothing but NaNs
+    lowest = first_of_segments(segment, y == np.fmin.reduceat(y, starts)[segment])
+    highest = first_of_segments(segment, y == np.fmax.reduceat(y, starts)[segment])
+    gaps = first_of_segments(segment, np.isnan(y))
+
+    chosen = np.concatenate((starts, ends - 1, lowest, highest, gaps))
+
+    return np.unique(chosen)
+
+# the position of the first point of each segment for which match is true, given the segment of each point in order
+def first_of_segments(segment, match):
+    positions = np.flatnonzero(match)
+    if len(positions) == 0:
+        return positions
+
+    return positions[np.r_[True, segment[positions][1:] != segment[positions][:-1]]]
+
+# the x and y values to draw, as arrays
+def minmax(x, y, xmin, xmax, width):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    rows = minmax_indices(x, y, xmin, xmax, width)
+
+    return x[rows], y[rows]
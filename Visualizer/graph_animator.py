@@ -19,38 +19,27 @@ from scipy import interpolate
 from pylab import *
 from coordinate_list import *
 import time
+import collections
+from matplotlib.collections import LineCollection
+from decimate import minmax_indices
 
 class GraphAnimator:
-     tag_report_array = None
-     GA_fig = None
-     GA_ax = None
-     GA_line = None
-     GA_lines = []
-     interval = 1000
-     x = []
-     y = []
-     xfield = ''
-     yfield = ''
-     unitx = ''
-     unity = ''
-     anim = None
-     fps = 30
-     time = 600000
-     nframes = fps * time / 1000000
-     dynamic_y_axis = True
-     sigfield = ''
-     coord_index = 0
-     plots = dict()
-     xtime = 0
-     title = ""
-     invert_y = False
+     # all of the animator's state is set in __init__, so that no instance shares a list or dict with another
 
      # initialization function: plot the background of each frame
      def init(self):
          self.GA_line.set_data([], [])
-         return self.GA_line,
+         return self.artists()
+
+     # the artists that animate_step changes, which are redrawn over the saved background of each frame when blitting
+     def artists(self):
+          if self.collection:
+               return self.GA_line, self.GA_collection
+          else:
+               return (self.GA_line,) + tuple(self.GA_lines)
 
      # can be optionally called by animate_step to compute the x axis scale based on a time window given, i.e., the last N seconds
+     # returns True if the x axis moved
      def recalculate_x_axis(self):
           if len(self.tag_report_array) > 0:
                max_relative_timestamp = self.tag_report_array[-1]['relative_timestamp']
@@ -61,6 +50,9 @@ class GraphAnimator:
                    newxmin = xmin + self.xtime
                    #print 'Resetting x axis to', newxmin, newxmax
                    self.GA_ax.set_xlim([newxmin, newxmax])
+                   return True
+
+          return False
 
 
      def getelementfield(self, e, field):
@@ -74,10 +66,11 @@ class GraphAnimator:
                return val[:-1]
         
      # can be optionally called by animate_step to compute the y axis scale based on the min and max y values seen
+     # returns True if the y axis changed; it is left alone while the range of y values seen stays the same
      def recalculate_y_axis(self):
-               if len(self.y) > 0:
-                    newmin = float(min(self.y))
-                    newmax = float(max(self.y))
+               if not (self.ymin is None):
+                    newmin = float(self.ymin)
+                    newmax = float(self.ymax)
 
                     if newmin > newmax:
                          temp = newmin
@@ -87,61 +80,116 @@ class GraphAnimator:
                     newmin = newmin - 5
                     newmax = newmax + 5
 
+                    if self.ylimits == (newmin, newmax):
+                         return False
+
+                    self.ylimits = (newmin, newmax)
                     self.GA_ax.set_ylim([newmin, newmax])
-                    #print 'Resetting y axis to', newmin, newmax, 'based on min and max of', float(min(self.y)), float(max(self.y))
+                    #print 'Resetting y axis to', newmin, newmax, 'based on min and max of', self.ymin, self.ymax
 
                     # invert the y axis if specified
                     if self.invert_y == True:
                          plt.gca().invert_yaxis()
 
+                    return True
+
+               return False
+
      # animation function.  This is called sequentially
      def animate_step(self, i):
           old_title = self.title # only update the title if it changes to save time
 
           # Search the tag_report_array for new tag entries, add them to the x and y animation plot, and graph
           # Assumes these are sorted by timestamp, but they can be sorted by tag_data if they are not
-          # Assumes the tag_report_array is updated by an external thread
-          for t in self.tag_report_array:
+          # Assumes the tag_report_array is updated by an external thread, which only ever appends to it, so only the entries appended since the last frame (from cursor on) are new
+          # The length is taken once, so that entries appended while this frame is drawn are left for the next one
+          end = len(self.tag_report_array)
+          for j in range(self.cursor, end):
+               t = self.tag_report_array[j]
+
                # if the x/y plots for this signature don't exist yet, create it before appending
                if not self.getelementfield(t, self.sigfield) in self.plots:
-                    self.plots[self.getelementfield(t, self.sigfield)] = CoordinateList(self.getelementfield(t, self.sigfield), self.coord_index)
+                    self.plots[self.getelementfield(t, self.sigfield)] = CoordinateList(self.getelementfield(t, self.sigfield), self.coord_index, span=self.span)
 
-                    # add a plot to the graph to go with this new data tag, should have an index of coord_index
-                    new_GA_line, = self.GA_ax.plot([], [], CL_plotcolors[self.coord_index % len(CL_plotcolors)] + '-', lw=2)
-                    self.GA_lines.append(new_GA_line)
+                    # add a plot to the graph to go with this new data tag, should have an index of coord_index; in collection mode it is a segment of the one collection
+                    if self.collection:
+                         self.GA_collection.set_color([CL_plotcolors[p.coord_index % len(CL_plotcolors)] for p in self.plots.values()])
+                    else:
+                         new_GA_line, = self.GA_ax.plot([], [], CL_plotcolors[self.coord_index % len(CL_plotcolors)] + '-', lw=2)
+                         self.GA_lines.append(new_GA_line)
 
                     # add the newly found RFID chip to the title with its legend identifier
                     self.title = self.title + str(self.coord_index) + ': ' + self.getelementfield(t, self.sigfield) + ' ' + CL_plotcolors[self.coord_index % len(CL_plotcolors)] + '-\n'
 
                     self.coord_index = self.coord_index + 1
 
-               if not (self.getelementfield(t, self.xfield) in self.x):
-                    self.x.append(self.getelementfield(t, self.xfield)) # still maintain global x/y list so that we can adjust the x/y axis using all plotted data (would need to scale)
-                    self.y.append(self.getelementfield(t, self.yfield))
+               # seen holds the x values (timestamps) already plotted, so that a duplicate is found without searching the x list
+               if not (self.getelementfield(t, self.xfield) in self.seen):
+                    self.seen.add(self.getelementfield(t, self.xfield))
+                    self.x.append(self.getelementfield(t, self.xfield)) # the x values in seen, oldest first, so that they can be forgotten once they are out of the window
+
+                    # keep the range of y values as they arrive, rather than searching the y list for it on every frame
+                    yval = float(self.getelementfield(t, self.yfield))
+                    if self.ymin is None or yval < self.ymin:
+                         self.ymin = yval
+                    if self.ymax is None or yval > self.ymax:
+                         self.ymax = yval
 
-                    self.plots[self.getelementfield(t, self.sigfield)].xvals.append(self.getelementfield(t, self.xfield)) # but also add it to the particular GA_line plot list
-                    self.plots[self.getelementfield(t, self.sigfield)].yvals.append(self.getelementfield(t, self.yfield))
+                    self.plots[self.getelementfield(t, self.sigfield)].append(self.getelementfield(t, self.xfield), self.getelementfield(t, self.yfield)) # but also add it to the particular GA_line plot list
 
-          for p in self.plots:
-               gal = self.GA_lines[self.plots[p].coord_index]
-               gal.set_data(self.plots[p].xvals, self.plots[p].yvals) # set the GA lines being plotted
+          self.cursor = end
+
+          # a duplicate of a point that has scrolled out of the window would not be visible, so stop remembering it
+          if not (self.span is None):
+               while len(self.x) > 0 and self.x[0] < self.x[-1] - self.span:
+                    self.seen.discard(self.x.popleft())
+
+          changed = False
 
           # recalculate the y axis ranges dynamically with a little buffer room
           if self.dynamic_y_axis == True:
-               self.recalculate_y_axis()
+               changed = self.recalculate_y_axis() or changed
 
           # set the x axis ranges if specified
           if self.xtime > 0:
-               self.recalculate_x_axis()
+               changed = self.recalculate_x_axis() or changed
+
+          # the axes are set first, so that each line is decimated to the points that can be seen at the x axis range it is drawn with (see decimate.py)
+          xmin, xmax = self.GA_ax.get_xlim()
+          width = self.GA_ax.bbox.width
+
+          if self.collection:
+               # one segment per signature, in the order of coord_index like the colors, all replaced at once
+               segments = []
+               for p in self.plots:
+                    points = self.plots[p].points
+                    rows = minmax_indices(points[:, 0], points[:, 1], xmin, xmax, width)
+                    if len(rows) < len(points):
+                         points = points[rows]
+                    segments.append(points)
+               self.GA_collection.set_segments(segments)
+          else:
+               for p in self.plots:
+                    gal = self.GA_lines[self.plots[p].coord_index]
+                    xvals, yvals = self.plots[p].xvals, self.plots[p].yvals
+                    rows = minmax_indices(xvals, yvals, xmin, xmax, width)
+                    if len(rows) < len(xvals):
+                         xvals, yvals = xvals[rows], yvals[rows]
+                    gal.set_data(xvals, yvals) # set the GA lines being plotted
 
           # set title
           if not self.title in old_title:
                plt.suptitle(self.title)
+               changed = True
+
+          # when blitting, the axes, ticks and title are only drawn into the saved background, so redraw it when they change; the animated artists are left out of this draw and blitted over it afterwards
+          if self.blit and changed:
+               self.GA_fig.canvas.draw()
             
           #plt.pause(0.1) # allow thread to re-draw
           time.sleep(0.025)
 
-          return self.GA_line, # is GA_line necessary anymore now that we have GA_lines?
+          return self.artists()
 
      def animate(self, moviefilename = None):
           # if saving a movie file, take more frames because 30 fps is too few to capture the entire movie; there is also a lag at the beginning which likely causes these wasted frames
@@ -151,7 +199,7 @@ class GraphAnimator:
           self.nframes = int(self.nframes)
                
           # call the animator.  blit=True means only re-draw the parts that have changed.
-          self.anim = animation.FuncAnimation(self.GA_fig, self.animate_step, init_func=self.init, frames=self.nframes, interval=self.interval, blit=False)
+          self.anim = animation.FuncAnimation(self.GA_fig, self.animate_step, init_func=self.init, frames=self.nframes, interval=self.interval, blit=self.blit)
 
           # clear, label and draw/update
           plt.ylabel(self.yfield + ' (' + self.unity + ')')
@@ -179,8 +227,19 @@ class GraphAnimator:
      # xmin and xmax are computed based on the length of the simulation, known a priori
         # xtime is whether to adjust the x axis dynamically and by how much upon reaching the right margin
         # invert_y is True if the y axis should be inverted
-     def __init__(self, _tag_report_array, xfield, yfield, unitx, unity, ymin=-256, ymax=256, interval=50, time=60 * 1000000, dynamic_y_axis=True, keyfield='epc96', xtime=0, invert_y=False):
+        # collection is True to draw every signature as a segment of one LineCollection rather than as a line of its own, which keeps the cost of drawing a frame flat as the number of tags grows
+        # blit is True to only redraw the plotted data each frame, over a saved background of the axes and title that is redrawn only when they change
+     def __init__(self, _tag_report_array, xfield, yfield, unitx, unity, ymin=-256, ymax=256, interval=50, time=60 * 1000000, dynamic_y_axis=True, keyfield='epc96', xtime=0, invert_y=False, collection=False, blit=False):
           self.tag_report_array = _tag_report_array
+          self.cursor = 0 # index of the first entry of tag_report_array not yet plotted
+
+          self.x = collections.deque()
+          self.seen = set()
+          self.ymin = None
+          self.ymax = None
+          self.plots = dict()
+          self.GA_lines = []
+          self.coord_index = 0
 
           self.xfield = xfield
           self.yfield = yfield
@@ -198,10 +257,21 @@ class GraphAnimator:
 
           self.xtime = xtime
 
+          # when the x axis scrolls, it shows the last time microseconds or so, so only those (and xtime more, as a margin) are kept for plotting
+          if xtime > 0:
+               self.span = time + xtime
+          else:
+               self.span = None
+
           self.title = ""
 
           self.invert_y = invert_y
 
+          self.collection = collection
+          self.blit = blit
+          self.ylimits = None
+          self.anim = None
+
           xmin = 0
           xmax = time
 
@@ -210,5 +280,10 @@ class GraphAnimator:
           self.GA_ax = plt.axes(xlim=(xmin, xmax), ylim=(ymin, ymax)) #plt.axes(xlim=(0, 2), ylim=(-2, 2))
           self.GA_line, = self.GA_ax.plot([], [], lw=2)
 
+          self.GA_collection = None
+          if self.collection:
+               self.GA_collection = LineCollection([], lw=2)
+               self.GA_ax.add_collection(self.GA_collection, autolim=False)
+
 # References:
 #     http://jakevdp.github.io/blog/2012/08/18/matplotlib-animation-tutorial/
@@ -0,0 +1,286 @@
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+import collections
+import numpy as np
+from iotjson import concat, nrows, column, take, is_columns, columns_of
+
+# A local cache of the tag reads recorded on a server, for replaying (-i) an experiment repeatedly, or without the
+# server.  Recorded data does not change, so a range of reads is stored once under a key computed from the server,
+# the range and the timescale, and is read back from then on without contacting the server.  A range may be stored
+# before the recording reaches its end, in which case it is only complete up to the end of the recording at the time,
+# and is replaced if it is later needed further on.
+#
+# Each range is a directory holding .npy files for each column, sorted by relative_timestamp, and an index.json
+# listing them.  The files are memory mapped when read, so a replay only reads the part of the recording that it
+# reaches, and numeric columns are handed out as views of the files.  Text columns are stored as their UTF-8 bytes
+# one after another, along with the offset at which each row's text starts, and a mask of any missing values.
+class RangeCache(object):
+    def __init__(self, cachedir):
+        self.cachedir = os.path.expanduser(cachedir)
+
+    def key(self, *fields):
+        return hashlib.sha256(json.dumps([str(field) for field in fields]).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key[:2], key)
+
+    # the index of a cached range, or None if it is not cached
+    def index(self, path):
+        indexfile = os.path.join(path, 'index.json')
+
+        if not os.path.isfile(indexfile):
+            return None
+
+        with open(indexfile) as f:
+            return json.load(f)
+
+    # the reads from start to end (in units of relative_timestamp) as a CachedRange, or None if they are not cached
+    # with every read up to complete (by default, end)
+    def get(self, server, start, end, timescale, complete=None):
+        if complete is None:
+            complete = end
+
+        path = self.path(self.key(server, start, end, timescale))
+        index = self.index(path)
+
+        if index is None or index.get('complete', index['end']) < complete:
+            return None
+
+        def load(filename):
+            return np.load(os.path.join(path, filename), mmap_mode='r')
+
+        columns = dict()
+        for col in index['columns']:
+            if col['text']:
+                null = None
+                if 'null' in col:
+                    null = load(col['null'])
+                columns[col['name']] = TextColumn(load(col['file']), load(col['offsets']), null)
+            else:
+                columns[col['name']] = load(col['file'])
+
+        return CachedRange(columns, index['rows'])
+
+    # store the reads from start to end, of which every read up to complete (by default, end) is in data, replacing any
+    # that were stored less complete; the directory is written under a temporary name and then renamed, so that an
+    # interrupted write is never read back as a complete range
+    def put(self, server, start, end, timescale, data, complete=None):
+        if complete is None:
+            complete = end
+
+        key = self.key(server, start, end, timescale)
+        path = self.path(key)
+
+        index = self.index(path)
+        if not (index is None) and index.get('complete', index['end']) >= complete:
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmppath = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.' + key + '.')
+
+        try:
+            data = sortedcolumns(data)
+
+            index = {'server': server, 'start': start, 'end': end, 'complete': complete, 'timescale': timescale, 'rows': nrows(data), 'columns': []}
+            for i, col in enumerate(data):
+                values = data[col]
+                entry = {'name': col, 'file': str(i) + '.npy', 'text': values.dtype.kind not in 'iufb'}
+
+                if entry['text']:
+                    null = np.array([v is None for v in values], dtype=bool)
+                    if null.any():
+                        entry['null'] = str(i) + '.null.npy'
+                        np.save(os.path.join(tmppath, entry['null']), null)
+
+                    encoded = [b'' if v is None else str(v).encode('utf-8') for v in values]
+                    offsets = np.zeros(len(encoded) + 1, dtype='int64')
+                    offsets[1:] = np.cumsum([len(e) for e in encoded])
+                    values = np.frombuffer(b''.join(encoded), dtype='uint8')
+
+                    entry['offsets'] = str(i) + '.offsets.npy'
+                    np.save(os.path.join(tmppath, entry['offsets']), offsets)
+
+                np.save(os.path.join(tmppath, entry['file']), values)
+                index['columns'].append(entry)
+
+            with open(os.path.join(tmppath, 'index.json'), 'w') as f:
+                json.dump(index, f)
+
+            # a less complete range is moved aside before it is replaced, and removed once it has been; files that
+            # are already memory mapped stay readable after they are removed
+            oldpath = None
+            if os.path.isdir(path):
+                oldpath = tempfile.mkdtemp(dir=os.path.dirname(path), prefix='.' + key + '.')
+                os.rename(path, os.path.join(oldpath, key))
+
+            os.rename(tmppath, path)
+
+            if not (oldpath is None):
+                shutil.rmtree(oldpath, ignore_errors=True)
+        except:
+            shutil.rmtree(tmppath, ignore_errors=True)
+            raise
+
+    # the reads from start up to (but not including) end, from the cache if every read up to complete (by default, end)
+    # is there, and otherwise fetched from the server with fetch(start, complete) and then cached; reads outside of the
+    # range are dropped, so that a read at the boundary of two ranges is kept only once
+    def load(self, server, start, end, timescale, fetch, complete=None):
+        if complete is None:
+            complete = end
+
+        cached = self.get(server, start, end, timescale, complete)
+
+        if cached is None:
+            self.put(server, start, end, timescale, fetchrange(fetch, start, complete), complete)
+            cached = self.get(server, start, end, timescale, complete)
+
+        return cached
+
+    # remember the most recent relative_timestamp recorded on a server, so that a replay can find it without the server
+    def put_maxtime(self, server, timescale, maxtime):
+        os.makedirs(self.cachedir, exist_ok=True)
+        with open(os.path.join(self.cachedir, self.key(server, timescale) + '.maxtime'), 'w') as f:
+            f.write(str(maxtime))
+
+    def get_maxtime(self, server, timescale):
+        maxtimefile = os.path.join(self.cachedir, self.key(server, timescale) + '.maxtime')
+
+        if not os.path.isfile(maxtimefile):
+            return None
+
+        with open(maxtimefile) as f:
+            return int(f.read())
+
+# the reads from start up to (but not including) end as fetched by fetch(start, end), without any reads outside of them
+def fetchrange(fetch, start, end):
+    data = fetch(start, end)
+    timestamps = np.asarray(column(data, 'relative_timestamp'), dtype='int64')
+
+    return take(data, (timestamps >= start) & (timestamps < end))
+
+# reads as a dict of typed columns sorted by relative_timestamp, i.e., with numbers that the server sent as strings as numbers
+def sortedcolumns(data):
+    if not is_columns(data):
+        data = columns_of(data, expand=False)
+
+    if nrows(data) == 0:
+        return dict()
+
+    order = np.argsort(np.asarray(column(data, 'relative_timestamp'), dtype='int64'), kind='mergesort')
+
+    return dict((col, np.asarray(data[col])[order]) for col in data)
+
+# A recording from start up to (but not including) end, read a chunk of the given number of units at a time as it is
+# reached, so that a replay starts at once and only one chunk is held in memory rather than the whole recording.  Each
+# chunk is fetched with fetch(chunkstart, chunkend) and written to the cache the first time it is read, and is read
+# from the cache from then on (or fetched every time if there is no cache).  Chunks are aligned to multiples of their
+# length from 0, so that replays of a recording that has grown since share all but its last chunk with earlier
+# replays; that chunk is cached only up to the end of the recording, and replaced when the recording grows past it.
+class CachedRecording(object):
+    def __init__(self, cache, server, start, end, timescale, fetch, chunk, keep=2):
+        self.cache = cache
+        self.server = server
+        self.start = start
+        self.end = end
+        self.timescale = timescale
+        self.fetch = fetch
+        self.chunk = max(1, int(chunk))
+        self.keep = keep # the number of chunks held open
+        self.chunks = collections.OrderedDict() # chunk start -> CachedRange of the chunks read most recently
+        self.lock = threading.Lock() # windows may be read from several threads at once, i.e., by a Prefetcher
+
+    # the CachedRange of the chunk starting at chunkstart
+    def read(self, chunkstart):
+        with self.lock:
+            if not (chunkstart in self.chunks):
+                chunkend = chunkstart + self.chunk
+                complete = min(chunkend, self.end)
+
+                if self.cache is None:
+                    data = sortedcolumns(fetchrange(self.fetch, chunkstart, complete))
+                    self.chunks[chunkstart] = CachedRange(data, nrows(data))
+                else:
+                    self.chunks[chunkstart] = self.cache.load(self.server, chunkstart, chunkend, self.timescale, self.fetch, complete)
+
+                while len(self.chunks) > self.keep:
+                    self.chunks.popitem(last=False)
+
+            return self.chunks[chunkstart]
+
+    # the rows with start <= relative_timestamp < end as a dict of columns, read from the chunks that they fall in
+    def window(self, start=None, end=None):
+        if start is None:
+            start = self.start
+        if end is None:
+            end = self.end
+
+        start = max(start, self.start)
+        end = min(end, self.end)
+
+        parts = []
+        chunkstart = (start // self.chunk) * self.chunk
+        while chunkstart < end:
+            parts.append(self.read(chunkstart).window(max(start, chunkstart), min(end, chunkstart + self.chunk)))
+            chunkstart = chunkstart + self.chunk
+
+        return concat(parts)
+
+# a memory mapped text column: the UTF-8 bytes of every row, and the offset of each row's text within them
+class TextColumn(object):
+    def __init__(self, data, offsets, null=None):
+        self.data = data
+        self.offsets = offsets
+        self.null = null
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # the text of rows [lo, hi) as an object array, with None for missing values
+    def values(self, lo, hi):
+        offsets = self.offsets[lo:hi + 1] - self.offsets[lo]
+        text = self.data[self.offsets[lo]:self.offsets[hi]].tobytes()
+
+        values = np.empty(hi - lo, dtype=object)
+        values[:] = [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(hi - lo)]
+
+        if not (self.null is None):
+            values[np.asarray(self.null[lo:hi])] = None
+
+        return values
+
+# the reads of a cached range, sorted by relative_timestamp
+class CachedRange(object):
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+    # the rows with start <= relative_timestamp < end as a dict of columns; numeric columns are views of the cache
+    def window(self, start=None, end=None):
+        if self.rows == 0:
+            return dict()
+
+        timestamps = self.columns['relative_timestamp']
+
+        lo = 0
+        if not (start is None):
+            lo = int(np.searchsorted(timestamps, start, side='left'))
+
+        hi = self.rows
+        if not (end is None):
+            hi = int(np.searchsorted(timestamps, end, side='left'))
+
+        data = dict()
+        for col in self.columns:
+            if isinstance(self.columns[col], TextColumn):
+                data[col] = self.columns[col].values(lo, hi)
+            else:
+                data[col] = self.columns[col][lo:hi]
+
+        return data
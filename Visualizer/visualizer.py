@@ -4,12 +4,14 @@ import json
 import time
 import threading
 from graph_animator import GraphAnimator
+from rangecache import RangeCache, CachedRecording
 import os
 import operator
 import datetime
 import math
 import numpy as np
-import requests
+from iotclient import IoTClient
+from iotjson import decode, accept_header, flatten_rows, to_rows
 
 cspeed = 2.99792458e8
 
@@ -29,6 +31,11 @@ simulate_real_time = False
 timescale = int(1e6)
 moviefile = None
 taglist = None
+http_timeout = 10
+http_retries = 3
+client = None
+cachedir = 'NONE'
+linecollection = False
 
 def log(msg):
     global do_debug
@@ -38,28 +45,21 @@ def log(msg):
 
 def sendhttp(url, headerdict=dict(), bodydict=dict(), method='POST'):
     global certfile
+    global http_timeout
+    global http_retries
+    global client
 
-    if certfile == 'NONE':
-        verifypath = False
-    else:
-        verifypath = certfile
-
-    if method.lower() == 'get':
-        fun = requests.get
-    elif method.lower() == 'put':
-        fun = requests.put
-    elif method.lower() == 'post':
-        fun = requests.post
-
-    response = fun(url, verify = verifypath, data = json.dumps(bodydict), headers=headerdict)
+    # all requests share one client, which keeps its connections to the server open between polls
+    if client is None:
+        client = IoTClient(certfile=certfile, timeout=http_timeout, retries=http_retries)
 
-    return response, response.text
+    return client.sendhttp(url, headerdict, bodydict, method)
     
 def retrieve_since(timestamp):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/' + str(timestamp), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/' + str(timestamp), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
     
@@ -67,7 +67,16 @@ def retrieve_last_n_data(n=1):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/seconds/' + str(n), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/seconds/' + str(n), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
+
+    return resp, content
+
+# like retrieve_data, but given in units of relative_timestamp rather than seconds
+def retrieve_range(starttime, endtime):
+    global db_password
+    global server
+
+    resp, content = sendhttp(server + '/api/iot/' + str(int(starttime)) + '/' + str(int(endtime)), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
 
@@ -76,7 +85,7 @@ def retrieve_data(start, end):
     global db_password
     global server
 
-    resp, content = sendhttp(server + '/api/iot/' + str(start * timescale) + '/' + str(end * timescale), headerdict={'Content-Type': 'application/json'}, bodydict={'data': {'db_password': db_password}}, method='POST')
+    resp, content = sendhttp(server + '/api/iot/' + str(start * timescale) + '/' + str(end * timescale), headerdict={'Content-Type': 'application/json', 'Accept': accept_header()}, bodydict={'data': {'db_password': db_password}}, method='POST')
 
     return resp, content
 
@@ -87,8 +96,39 @@ def get_max_reltime():
 
     return resp, content
 
+# the most recent relative_timestamp on the server, or (if the server cannot be reached) the most recent one cached
+def get_max_db_time(cache):
+    global server
+    global timescale
+
+    try:
+        resp, content = get_max_reltime()
+        max_db_time = int(decode(resp, content)['data'][0]['max_relative_timestamp'])
+    except Exception as e:
+        if cache is None or cache.get_maxtime(server, timescale) is None:
+            raise
+        log('Could not reach the server (' + str(e) + '); replaying the cached recording')
+        return cache.get_maxtime(server, timescale)
+
+    if not (cache is None):
+        cache.put_maxtime(server, timescale, max_db_time)
+
+    return max_db_time
+
+# the whole recording up to max_db_time, read a minute at a time as the replay reaches it: from the cache if that
+# minute has been replayed before, or else downloaded and cached
+def open_recording(cache, max_db_time):
+    global server
+    global timescale
+
+    def fetch(starttime, endtime):
+        resp, content = retrieve_range(starttime, endtime)
+        return decode(resp, content)['data']
+
+    return CachedRecording(cache, server, 0, max_db_time + 1, timescale, fetch, chunk=60 * timescale)
+
 ############################################## OPTIONS
-def usage(server, db_password, certfile, timescale, simulate_real_time, moviefile, do_debug):
+def usage(server, db_password, certfile, timescale, simulate_real_time, moviefile, http_timeout, http_retries, cachedir, linecollection, do_debug):
 	print('%s [<options>]' % sys.argv[0])
 	print('where <options> are:\n' \
 			'\t-h - show this help message\n' \
@@ -98,8 +138,12 @@ def usage(server, db_password, certfile, timescale, simulate_real_time, moviefil
             '\t-t <timescale> - scale of interrogator time (i.e., 1 for 1 unit per second): default %s\n' \
             '\t-i - simulate real-time by going through the whole database contents from the beginning, instead of pulling from the end: default %s\n' \
             '\t-m <moviefile> - optionally output to a video file\n' \
+            '\t-w <seconds> - seconds to wait for the server to respond to a request: default %s\n' \
+            '\t-y <retries> - number of times to retry a failed request to the server: default %s\n' \
+            '\t-e <directory> - directory in which to cache the recording when simulating real-time (-i), i.e., ~/.cache/iot-processing-framework, or NONE to always download it: default %s\n' \
+            '\t-l - draw all of the tags as a single line collection, redrawing only the plotted data each frame (for many tags): default %s\n' \
 			'\t-d - Enable debugging: default %s\n' \
-            '\t-f <tag,tag> - filter by comma separated list of tags to show (default: show all tags)\n' % (server, db_password, certfile, timescale, simulate_real_time, do_debug))
+            '\t-f <tag,tag> - filter by comma separated list of tags to show (default: show all tags)\n' % (server, db_password, certfile, timescale, simulate_real_time, http_timeout, http_retries, cachedir, linecollection, do_debug))
 	sys.exit(1)
 
 def getopts():
@@ -111,12 +155,16 @@ def getopts():
     global do_debug
     global moviefile
     global taglist
+    global http_timeout
+    global http_retries
+    global cachedir
+    global linecollection
 
 	# Check command line
-    optlist, list = getopt.getopt(sys.argv[1:], 'ho:p:c:t:dim:f:')
+    optlist, list = getopt.getopt(sys.argv[1:], 'ho:p:c:t:dim:f:w:y:e:l')
     for opt in optlist:
         if opt[0] == '-h':
-            usage(server, db_password, certfile, timescale, simulate_real_time, moviefile, do_debug)
+            usage(server, db_password, certfile, timescale, simulate_real_time, moviefile, http_timeout, http_retries, cachedir, linecollection, do_debug)
         if opt[0] == '-p':
             db_password = opt[1]
         if opt[0] == '-o':
@@ -131,6 +179,14 @@ def getopts():
             do_debug = True
         if opt[0] == '-m':
             moviefile = opt[1]
+        if opt[0] == '-w':
+            http_timeout = float(opt[1])
+        if opt[0] == '-y':
+            http_retries = int(opt[1])
+        if opt[0] == '-e':
+            cachedir = opt[1]
+        if opt[0] == '-l':
+            linecollection = True
         if opt[0] == '-f':
             if ',' in opt[1]:
                 taglist = opt[1].split(',')
@@ -157,8 +213,9 @@ def prog_quit(QUITFILE='quit'):
 # Separate plots for each signature
 def animate(tag_array):
 	global moviefile
+	global linecollection
 
-	ganim = GraphAnimator(tag_array, xfield='relative_timestamp', yfield='rssi', unitx='time', unity='Prx dBm', time=60000000, dynamic_y_axis=True, keyfield='epc96|antenna', xtime=5000000, invert_y=False, interval=10)
+	ganim = GraphAnimator(tag_array, xfield='relative_timestamp', yfield='rssi', unitx='time', unity='Prx dBm', time=60000000, dynamic_y_axis=True, keyfield='epc96|antenna', xtime=5000000, invert_y=False, interval=10, collection=linecollection, blit=linecollection)
 	ganim.animate(moviefile)
 
 def add_tags_to_tagarray(body, ta):
@@ -183,15 +240,10 @@ def add_tags_to_tagarray(body, ta):
         #ta.append(entry)         
 
 def aggregate_by_channel(body):    
+    # merge the freeform fields into each row, keeping their values as numbers rather than strings
+    flatten_rows(body['data'])
+
     for row in body['data']:
-        freeform = json.loads(row['freeform'], parse_int=False, parse_float=False)
-            
-        while not (type(freeform) is dict):
-            freeform = json.loads(freeform, parse_int=False, parse_float=False)
-            
-        for col in freeform:
-            row[col] = str(freeform[col])
-        
         # Solve for moving_parts == gtag**2 * R (the return loss) / r**4 (the radius)
         prxLinear = 10**(float(row['rssi']) * 0.1) * 1.0 / 1000 # convert to Watts from dbm
         ptx = 1 # 1W = 30 dbm power from transmitter
@@ -212,13 +264,19 @@ def get_max_time_in_body(body):
     
 def readdata(ta):
     global timescale
+    global cachedir
 
-    # if simulating real time, figure out how long the database goes
+    # if simulating real time, figure out how long the database goes, and open the recording if it is to be cached
+    recording = None
     if simulate_real_time == True:
-        resp, content = get_max_reltime()
-        body = json.loads(content)
-        #print body
-        max_db_time = int(body['data'][0]['max_relative_timestamp'])
+        cache = None
+        if cachedir != 'NONE':
+            cache = RangeCache(cachedir)
+
+        max_db_time = get_max_db_time(cache)
+
+        if not (cache is None):
+            recording = open_recording(cache, max_db_time)
     else:
         max_db_time = -1
 
@@ -233,20 +291,28 @@ def readdata(ta):
                 time.sleep(0.025)
                 
         # get data
-        if simulate_real_time == True:
-            resp, content = retrieve_data(iterations, iterations+seconds)
+        if simulate_real_time == True and not (recording is None):
+            body = {'data': recording.window(iterations * timescale, (iterations+seconds) * timescale)}
+
+            prevread = datetime.datetime.now()
         else:
-            if lastreltime == -1:
-                resp, content = retrieve_last_n_data(n=seconds)
+            if simulate_real_time == True:
+                resp, content = retrieve_data(iterations, iterations+seconds)
             else:
-                resp, content = retrieve_since(lastreltime)
-        
-        prevread = datetime.datetime.now()
+                if lastreltime == -1:
+                    resp, content = retrieve_last_n_data(n=seconds)
+                else:
+                    resp, content = retrieve_since(lastreltime)
 
-        try:
-            body = json.loads(content)
-        except:
-            continue
+            prevread = datetime.datetime.now()
+
+            try:
+                body = decode(resp, content)
+            except:
+                continue
+
+        # the tag array holds rows, so convert the columns of a binary response or of the cache
+        body['data'] = to_rows(body['data'])
             
         lastreltime = get_max_time_in_body(body)
 
@@ -28,6 +28,8 @@ pip3 install --user python-dateutil
 # Packages needed by common ML/DSP systems that depend on the IOT Sensor Framework
 pip3 install --user pandas
 pip3 install --user filterpy
+pip3 install --user orjson # optional, for faster decoding of server responses
+pip3 install --user msgpack # optional, for the columnar binary format of server responses
 
 pip3 install --user 2to3
 sudo apt-get install 2to3